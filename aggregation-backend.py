@@ -0,0 +1,281 @@
+#@title Aggregation Backend (pandas reference / DuckDB on the parquet files)
+# Run after parquet-storage.py. The analysis cells call the agg_* functions below instead of
+# running groupby/quantile/nunique themselves, so the engine can be switched per session:
+#   pandas  reference implementation on frames from load_dataset() (single-threaded; the
+#           quantiles use the single-pass numpy engine daily_quantiles())
+#   duckdb  multi-threaded SQL straight over the local parquet files (no pandas load)
+# Both return the same frames (same index, columns and dtypes).
+import os
+
+import numpy as np
+import pandas as pd
+
+aggregation_engine = 'pandas'   #@param ["pandas", "duckdb"]
+
+if aggregation_engine == 'duckdb':
+    try:
+        import duckdb
+        _agg_con = duckdb.connect()
+        _agg_con.execute(f"set threads to {os.cpu_count()}")
+    except ImportError:
+        print('duckdb is not installed (pip install duckdb); using the pandas engine')
+        aggregation_engine = 'pandas'
+
+_AGG_SQL = {'nunique': 'count(distinct {})', 'sum': 'sum({})', 'max': 'max({})', 'min': 'min({})', 'count': 'count({})'}
+
+def _restore_kinds(df: pd.DataFrame, name: str, columns) -> pd.DataFrame:
+    """Give key columns the in-memory dtypes load_dataset() would have produced."""
+    for col in columns:
+        kind = DATASET_SCHEMAS[name].get(col)
+        if kind is not None:
+            df[col] = _as_kind(df[col], kind)
+            if kind == 'date':
+                df[col] = df[col].astype('datetime64[ms]')
+    return df
+
+def _source_categories(df: pd.DataFrame, name: str, columns) -> pd.DataFrame:
+    """Give category columns the full category list of the dataset, as a pandas load has
+    (SQL only returns the values that survived the filters)."""
+    for col in columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            categories = read_dataset(name, columns=[col])[col].cat.categories
+            df[col] = df[col].cat.set_categories(categories)
+    return df
+
+def _duckdb_source(name: str) -> str:
+    """read_parquet() over the dataset's local files (hive partition columns included)."""
+    path = dataset_path(name)
+    if DATASET_LAYOUTS[name]['partition'] and not os.path.isdir(drive_path(name)) and os.path.exists(drive_path(name) + '.parquet'):
+        path += '.parquet'   # single file saved before the partitioned layout
+    mirror_pull(path)
+    if os.path.isdir(path):
+        return f"read_parquet('{path}/**/*.parquet', hive_partitioning = true)"
+    return f"read_parquet('{path}')"
+
+def _sql_list(values) -> str:
+    return ', '.join("'" + str(v).replace("'", "''") + "'" if isinstance(v, str) else str(v) for v in values)
+
+# ----------------------------
+# Daily quantiles per segment
+# ----------------------------
+def _run_quantiles(values: np.ndarray, groups: np.ndarray, n_groups: int, qs) -> np.ndarray:
+    """(n_groups, len(qs)) linear-interpolated quantiles of values sorted by (group, value).
+
+    Same interpolation as pandas' quantile(): h = (n - 1) * q between the two nearest ranks.
+    Groups without values get NaN.
+    """
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    out = np.full((n_groups, len(qs)), np.nan)
+    has = counts > 0
+    n, first = counts[has], starts[has]
+    for j, q in enumerate(qs):
+        h = (n - 1) * q
+        lo = np.floor(h).astype(np.int64)
+        x_lo = values[first + lo]
+        x_hi = values[first + np.minimum(lo + 1, n - 1)]
+        out[has, j] = x_lo + (h - lo) * (x_hi - x_lo)
+    return out
+
+def _sort_by_date_value(values: np.ndarray, date_codes: np.ndarray, seg_codes: np.ndarray, n_dates: int, n_segs: int):
+    """Values, date codes and segment codes (+1, null = 0) of the non-null rows, ordered by (date, value)."""
+    rows = (date_codes >= 0) & ~np.isnan(values)
+    v, d, seg = values[rows], date_codes[rows].astype(np.int64), seg_codes[rows].astype(np.int64) + 1
+    seg_bits = n_segs.bit_length() + 1
+    date_shift = 63 - max(n_dates.bit_length(), 1)
+    if len(v) and np.array_equal(v, np.rint(v)) and v.max() - v.min() < 2 ** (date_shift - seg_bits):
+        # integer values: pack (date, value, segment) into one int64 key and sort the keys
+        # themselves, which is much cheaper than an argsort followed by gathers
+        lo = v.min()
+        key = (d << date_shift) | ((v - lo).astype(np.int64) << seg_bits) | seg
+        key.sort()
+        value_mask = (1 << (date_shift - seg_bits)) - 1
+        return ((key >> seg_bits) & value_mask) + lo, key >> date_shift, key & ((1 << seg_bits) - 1)
+    order = np.argsort(v)
+    # small-int date codes: numpy's stable sort is a radix sort on them
+    order = order[np.argsort(d[order].astype(np.int16 if n_dates < 2**15 else np.int32), kind='stable')]
+    return v[order], d[order], seg[order]
+
+def daily_quantiles(df: pd.DataFrame, columns, qs, date_col: str = 'promo_date', segment_col: str = 'is_payer') -> dict:
+    """Single-pass quantile engine: {column: frame} indexed (segment, date) with an 'All' segment.
+
+    Each column is sorted by (date, value) once; the overall quantiles read each date's run
+    and every segment's runs are subsequences of the same order, so nothing is re-sorted.
+    """
+    date_codes, date_values = pd.factorize(df[date_col], sort=True)
+    seg_codes, seg_values = pd.factorize(df[segment_col], sort=True)
+    n_dates, n_segs = len(date_values), len(seg_values)
+    # (segment, date) pairs that have rows, even when the column is null there (as groupby)
+    seg_observed = [
+        np.bincount(date_codes[(seg_codes == s) & (date_codes >= 0)], minlength=n_dates) > 0 for s in range(n_segs)
+    ]
+    seen_dates = [np.flatnonzero(seen) for seen in seg_observed]
+    seg_index = pd.MultiIndex.from_arrays([
+        seg_values.take(np.repeat(np.arange(n_segs), [len(d) for d in seen_dates])),
+        date_values.take(np.concatenate(seen_dates) if seen_dates else np.empty(0, dtype=np.int64)),
+    ], names=[segment_col, date_col])
+    all_index = pd.MultiIndex.from_product([['All'], date_values], names=[segment_col, date_col])
+    q_index = pd.Index(list(qs), name='q')
+    out = {}
+    for col in columns:
+        if col not in df.columns:
+            out[col] = None
+            continue
+        values = df[col].to_numpy(dtype='float64', na_value=np.nan)
+        sorted_values, sorted_dates, sorted_segs = _sort_by_date_value(values, date_codes, seg_codes, n_dates, n_segs)
+
+        overall = _run_quantiles(sorted_values, sorted_dates, n_dates, qs)
+        by_segment = []
+        for s in range(n_segs):
+            in_seg = sorted_segs == s + 1
+            by_segment.append(_run_quantiles(sorted_values[in_seg], sorted_dates[in_seg], n_dates, qs)[seg_observed[s]])
+        out[col] = pd.concat([
+            pd.DataFrame(overall, index=all_index, columns=q_index),
+            pd.DataFrame(np.vstack(by_segment) if by_segment else np.empty((0, len(qs))), index=seg_index, columns=q_index),
+        ]).sort_index()
+    return out
+
+def _pandas_daily_quantiles(name, columns, qs, date_col, segment_col, dates):
+    if dates is None:
+        df = load_dataset(name, [date_col, segment_col, *columns])
+    else:
+        df = read_dataset(name, columns=[date_col, segment_col, *columns], filters=[(date_col, 'in', dates)], hot_cache=False)
+    return daily_quantiles(df, columns, qs, date_col, segment_col)
+
+def _duckdb_daily_quantiles(name, columns, qs, date_col, segment_col, dates):
+    in_dates = '' if dates is None else \
+        f'and "{date_col}" in ({_sql_list([d.isoformat() for d in dates])})' if dates else 'and false'
+    selects = ', '.join(f'quantile_cont("{col}", {q}) as "{col}|{q}"' for col in columns for q in qs)
+    df = _agg_con.execute(f"""
+        select grouping("{segment_col}") as _overall, "{segment_col}", "{date_col}", {selects}
+        from {_duckdb_source(name)}
+        where "{date_col}" is not null {in_dates}
+        group by grouping sets (("{date_col}"), ("{segment_col}", "{date_col}"))
+    """).df()
+    df = df[(df['_overall'] == 1) | df[segment_col].notna()]
+    df = _restore_kinds(df, name, [date_col])
+    # same construction as daily_quantiles(): an ('All', date) block and a (segment, date) block,
+    # concatenated and sorted, so both engines return the same row order and index dtypes
+    overall = df[df['_overall'] == 1].sort_values(date_col)
+    by_segment = df[df['_overall'] == 0].sort_values([segment_col, date_col])
+    all_index = pd.MultiIndex.from_product([['All'], pd.Index(overall[date_col])], names=[segment_col, date_col])
+    seg_index = pd.MultiIndex.from_arrays([
+        pd.Index(_as_kind(by_segment[segment_col], DATASET_SCHEMAS[name][segment_col])),
+        pd.Index(by_segment[date_col]),
+    ], names=[segment_col, date_col])
+    q_index = pd.Index(qs, name='q')
+    out = {}
+    for col in columns:
+        q_cols = [f'{col}|{q}' for q in qs]
+        out[col] = pd.concat([
+            pd.DataFrame(overall[q_cols].to_numpy(dtype='float64'), index=all_index, columns=q_index),
+            pd.DataFrame(by_segment[q_cols].to_numpy(dtype='float64'), index=seg_index, columns=q_index),
+        ]).sort_index()
+    return out
+
+def agg_daily_quantiles(name: str, columns, qs, date_col: str = 'promo_date', segment_col: str = 'is_payer',
+                        dates=None) -> dict:
+    """{column: frame} of linear-interpolated quantiles per day, index (segment, date) with an 'All' segment.
+
+    dates: only these days (datetime.date partitions, read straight from parquet), else all of them.
+    """
+    dates = None if dates is None else list(dates)
+    if aggregation_engine == 'duckdb':
+        return _duckdb_daily_quantiles(name, list(columns), list(qs), date_col, segment_col, dates)
+    return _pandas_daily_quantiles(name, list(columns), list(qs), date_col, segment_col, dates)
+
+# summary-mode segments; 'true' / 'false' come from files written before the SQL cast is_payer::int
+_SUMMARY_SEGMENTS = {'all': 'All', '0': 0, '1': 1, 'false': 0, 'true': 1}
+
+def summary_daily_quantiles(summary: pd.DataFrame, metric: str, qs):
+    """agg_daily_quantiles-shaped frame of `metric` from the Snowflake summary table
+    (energy_quantiles: one row per promo_date, segment, metric with p50.. columns), or None."""
+    rows = summary[summary['metric'] == metric]
+    q_cols = {f"p{int(q*100)}": q for q in qs if f"p{int(q*100)}" in rows.columns}
+    if rows.empty or not q_cols:
+        return None
+    frame = rows[['promo_date'] + list(q_cols)].rename(columns=q_cols)
+    segment = rows['segment'].astype(str).str.strip().str.lower()
+    frame['is_payer'] = segment.map(_SUMMARY_SEGMENTS)
+    if frame['is_payer'].isna().any():
+        raise ValueError(f"unexpected energy_quantiles segment(s): {sorted(set(segment[frame['is_payer'].isna()]))}")
+    return frame.set_index(['is_payer', 'promo_date']).rename_axis(columns='q').sort_index()
+
+# ----------------------------
+# Weighted quantiles of histograms
+# ----------------------------
+def weighted_quantiles(df: pd.DataFrame, group_cols, value_col: str, weight_col: str, qs) -> pd.DataFrame:
+    """Weighted quantiles of (group..., value, count) histogram rows, all groups in one pass.
+
+    For every group the value is the first one (in value order) whose cumulative weight share
+    reaches q, as np.searchsorted(cdf, q, side='left') clamped to the largest value. Suits
+    players per MB/dice position or per puzzle level: index = group keys, columns = qs.
+    """
+    group_cols = [group_cols] if isinstance(group_cols, str) else list(group_cols)
+    df = df[df[group_cols].notna().all(axis=1)]
+    groups = df.groupby(group_cols, sort=True, observed=True).ngroup().to_numpy()
+    values, weights = df[value_col].to_numpy(), df[weight_col].to_numpy()
+    order = np.lexsort((values, groups))
+    groups, values, weights = groups[order], values[order], weights[order]
+    n_groups = groups.max() + 1 if len(groups) else 0
+
+    starts = np.searchsorted(groups, np.arange(n_groups))
+    ends = np.append(starts[1:], len(groups)) if n_groups else starts
+    cum = np.cumsum(weights)
+    before = np.repeat(cum[starts] - weights[starts], ends - starts)   # weight of earlier groups
+    totals = np.repeat(cum[ends - 1] - cum[starts] + weights[starts], ends - starts)
+    cdf = (cum - before) / totals
+    positions = np.arange(len(cdf))
+
+    out = np.empty((n_groups, len(qs)), dtype=values.dtype if len(values) else 'float64')
+    for j, q in enumerate(qs):
+        # first position per group with cdf >= q; none (rounding at q=1) -> last value
+        first = np.minimum.reduceat(np.where(cdf >= q, positions, len(cdf)), starts) if n_groups else starts
+        out[:, j] = values[np.minimum(first, ends - 1)]
+    keys = df[group_cols].iloc[order].drop_duplicates()
+    index = pd.MultiIndex.from_frame(keys) if len(group_cols) > 1 else pd.Index(keys[group_cols[0]])
+    return pd.DataFrame(out, index=index, columns=pd.Index(list(qs)))
+
+# ----------------------------
+# Grouped aggregates (nunique / sum / max / ...)
+# ----------------------------
+def _pandas_grouped(name, keys, value, how, where, required):
+    df = load_dataset(name, list(dict.fromkeys([*keys, value, *where, *required])))
+    df = df.dropna(subset=list(dict.fromkeys([*keys, value, *required])))
+    for col, allowed in where.items():
+        df = df[df[col].isin(list(allowed))]
+    return df.groupby(keys, observed=True)[value].agg(how).reset_index()
+
+def _duckdb_grouped(name, keys, value, how, where, required):
+    key_sql = ', '.join(f'"{k}"' for k in keys)
+    conditions = [f'"{c}" is not null' for c in dict.fromkeys([*keys, value, *required])]
+    conditions += [f'"{c}" in ({_sql_list(allowed)})' if len(allowed) else 'false' for c, allowed in where.items()]
+    df = _agg_con.execute(f"""
+        select {key_sql}, {_AGG_SQL[how].format(f'"{value}"')} as "{value}"
+        from {_duckdb_source(name)}
+        where {' and '.join(conditions)}
+        group by {key_sql}
+        order by {key_sql}
+    """).df()
+    return _source_categories(_restore_kinds(df, name, keys), name, keys)
+
+def agg_grouped(name: str, keys, value: str, how: str, where=None, required=()) -> pd.DataFrame:
+    """`how` of `value` per `keys` on dataset `name`, as a flat frame sorted by keys.
+
+    where: {column: allowed values}. Rows with nulls in keys, value or `required` are dropped.
+    """
+    where = {col: list(allowed) for col, allowed in (where or {}).items()}
+    grouped = _duckdb_grouped if aggregation_engine == 'duckdb' else _pandas_grouped
+    df = grouped(name, list(keys), value, how, where, list(required))
+    # the value dtype follows the result, not the source column, so both engines agree
+    if how in ('nunique', 'count'):
+        df[value] = df[value].astype('int64')
+    elif value in DATASET_SCHEMAS[name]:
+        df[value] = _as_kind(df[value], DATASET_SCHEMAS[name][value])
+    return df
+
+def agg_unique_players(name: str, keys, where=None, required=()) -> pd.DataFrame:
+    """Distinct player_id per `keys`, as a frame with an 'unique_players' column."""
+    return agg_grouped(name, keys, 'player_id', 'nunique', where, required).rename(columns={'player_id': 'unique_players'})
+
+print(f'Aggregation engine: {aggregation_engine}')
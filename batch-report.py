@@ -0,0 +1,212 @@
+# Batch Report (headless: every chart variant to PNG / HTML in parallel worker processes)
+# Runs locally, outside Colab, against a copy of the Drive data folder:
+#
+#   python batch-report.py --data-path "/path/to/Economy Investigation" --out report --workers 4
+#
+# The storage / aggregation / cube / derived-table / pipeline / renderer / chart-builder cells
+# are executed in this process (their #@param values set for a local run: no Drive mirror, no
+# hot cache), the chart data is loaded once through pipeline stages, and a forked process
+# pool - which inherits the loaded frames read-only, nothing is pickled - renders every
+# variant: payer splits and percentile sets of the energy charts, percentile sets of the MB
+# trend, one file per puzzle max-level bucket, and the MB scatter / dice distribution as
+# standalone Plotly HTML. Data and figures come from chart-builders.py, the functions the
+# analysis cells call; this script only fans the variants out.
+# Writes <out>/<chart>/<variant>.png|html and <out>/index.html. ipywidgets is not needed.
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+BATCH_CELLS = ['data-schema', 'parquet-storage', 'aggregation-backend', 'quantile-sketches',
+               'progression-cube', 'derived-table-store', 'pipeline-runner', 'plot-renderer', 'chart-builders']
+BATCH_PARAMS = {'mirror_enabled': False, 'hot_cache_enabled': False}
+
+batch_qs = [0.5, 0.75, 0.9, 0.95, 0.99]   # same percentiles as the cells (shares their derived tables)
+BATCH_PERCENTILE_SETS = {'all': batch_qs, 'median': [0.5], 'upper': [0.9, 0.95, 0.99]}
+BATCH_PAYERS = {'all': 'All', 'non-payers': 0, 'payers': 1}
+batch_min_event_players = 1000   # MB / dice events with fewer players are left out, as in the cells
+
+BATCH_DATA = {}   # stage name -> value; loaded before the pool forks, read-only afterwards
+
+def batch_cell(name: str, params: dict):
+    """Execute <name>.py from this directory in this namespace, with its form params replaced."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), f'{name}.py')
+    with open(path) as fh:
+        source = fh.read()
+    for param, value in params.items():
+        source = re.sub(rf'^{param}(\s*)=.*#@param.*$', rf'{param}\1= {value!r}', source, flags=re.M)
+    exec(compile(source, path, 'exec'), globals())
+
+# ----------------------------
+# Data stages (parent process, once) - the cells' data, from chart-builders.py
+# ----------------------------
+def batch_energy_stage():
+    """{metric: daily percentile frame} for the EOP / BOP balance and total energy out."""
+    if not (dataset_available('player_balance') or dataset_available('energy_quantiles')):
+        return {}
+    return {**energy_percentiles('bep_quantiles', ['energy_balance_eop', 'energy_balance_bop'], batch_qs),
+            **energy_percentiles('quantiles_toe', ['total_energy_out'], batch_qs)}
+
+def batch_mb_stage():
+    """(MB position shares, weighted position percentiles per event)."""
+    shares = event_shares('mb', 'percentage_of_total_players', min_players=batch_min_event_players)
+    return shares, mb_position_percentiles(shares, batch_qs)
+
+def batch_dice_stage():
+    return event_shares('dice', 'pct_of_total', min_players=batch_min_event_players)
+
+def batch_puzzle_stage():
+    """progression_array('puzzle') plus each config's max level reached."""
+    counts, configs, events, levels = progression_array('puzzle')
+    return counts, configs, events, levels, puzzle_max_levels(counts, configs, levels)
+
+BATCH_STAGES = {
+    'batch_energy': (batch_energy_stage, ['player_balance', 'energy_quantiles']),
+    'batch_mb':     (batch_mb_stage,     ['progression_cube', 'mb_progression']),
+    'batch_dice':   (batch_dice_stage,   ['progression_cube', 'dice_progression']),
+    'batch_puzzle': (batch_puzzle_stage, ['progression_cube', 'puzzle_progression']),
+}
+
+# ----------------------------
+# Charts (worker processes): one variant of a chart-builders.py chart per call
+# ----------------------------
+def batch_energy_chart(path: str, metrics: dict, payer, qs, title: str, ylabel: str):
+    """Percentile lines of `metrics` = {metric: (label prefix, line style)} for one payer split."""
+    qframes = {metric: BATCH_DATA['batch_energy'].get(metric) for metric in metrics}
+    first = next(iter(qframes.values()))
+    # campaign starts over the days the chart's first metric covers, as in the cells
+    dates = first.index.get_level_values('promo_date').unique() if first is not None else []
+    view = render_view('batch_energy', figsize=(20, 6))
+    chart_energy(view, [(prefix, percentile_slice(qframes[metric], payer, qs=batch_qs), style)
+                        for metric, (prefix, style) in metrics.items()],
+                 qs, percentile_labels(batch_qs), title, ylabel, campaign_starts(dates))
+    view_save(view, path)
+
+def batch_mb_trend_chart(path: str, qs):
+    view = render_view('batch_mb_trend', figsize=(20, 6), layout='tight')
+    chart_mb_trend(view, BATCH_DATA['batch_mb'][1], qs, percentile_labels(batch_qs), BATCH_DATA['story_firsts'])
+    view_save(view, path)
+
+def batch_puzzle_chart(path: str, max_level):
+    """One max-level bucket (or 'All'), all configs of it."""
+    counts, configs, events, levels, max_levels = BATCH_DATA['batch_puzzle']
+    mask = np.ones(len(configs), bool) if max_level == 'All' else (max_levels['max_levels'] == max_level).to_numpy()
+    suffix = f"MAX levels = {max_level}" if max_level != 'All' else "All levels"
+    view = render_view('batch_puzzle', figsize=(14, 5), layout='tight')
+    chart_puzzle_levels(view, counts[mask].sum(axis=0), events, levels,
+                        f'Players % by Levels Completed per PUZZLE Event — {suffix}, All configs')
+    view_save(view, path)
+
+def batch_mb_scatter_chart(path: str):
+    fig = chart_mb_scatter(BATCH_DATA['batch_mb'][0], BATCH_DATA['story_firsts'])
+    plotly_prune(fig).write_html(path, include_plotlyjs='cdn')
+
+def batch_dice_chart(path: str):
+    plotly_prune(chart_dice_bars(BATCH_DATA['batch_dice'])).write_html(path, include_plotlyjs='cdn')
+
+BATCH_CHARTS = {
+    'energy-balance': batch_energy_chart,
+    'energy-out': batch_energy_chart,
+    'missionbar-trends': batch_mb_trend_chart,
+    'missionbar-scatter': batch_mb_scatter_chart,
+    'dice-user-distribution': batch_dice_chart,
+    'puzzle-progression': batch_puzzle_chart,
+}
+
+def batch_tasks() -> list:
+    """[(chart, variant file name, kwargs)] for every chart variant of the loaded data."""
+    tasks = []
+    for payer_name, payer in BATCH_PAYERS.items():
+        for qs_name, qs in BATCH_PERCENTILE_SETS.items():
+            tasks.append(('energy-balance', f'{payer_name}-{qs_name}.png', dict(
+                metrics={'energy_balance_eop': ('eop ', {'linestyle': '-'}),
+                         'energy_balance_bop': ('bop ', {'linestyle': '--'})},
+                payer=payer, qs=qs, title=f'Balance BOP vs EOP Percentiles Over Time — {payer_name}', ylabel='Balance')))
+            tasks.append(('energy-out', f'{payer_name}-{qs_name}.png', dict(
+                metrics={'total_energy_out': ('', {})}, payer=payer, qs=qs,
+                title=f'Total Energy Out Percentiles Over Time — {payer_name}',
+                ylabel='Total Energy Out (per-player percentile)')))
+    tasks += [('missionbar-trends', f'{qs_name}.png', dict(qs=qs)) for qs_name, qs in BATCH_PERCENTILE_SETS.items()]
+    tasks += [('missionbar-scatter', 'scatter.html', {}), ('dice-user-distribution', 'distribution.html', {})]
+    max_levels = BATCH_DATA['batch_puzzle'][4]['max_levels']
+    tasks += [('puzzle-progression', f'max-levels-{level}.png', dict(max_level=level))
+              for level in ['All', *sorted(max_levels.dropna().astype(int).unique().tolist())]]
+    return tasks
+
+def batch_render(out_dir: str, chart: str, variant: str, kwargs: dict) -> str:
+    path = os.path.join(out_dir, chart, variant)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    BATCH_CHARTS[chart](path, **kwargs)
+    return path
+
+def batch_index(out_dir: str, paths: list):
+    """index.html: every PNG inline and every HTML chart linked, grouped by chart."""
+    html = ['<html><head><meta charset="utf-8"><title>Economy report</title></head><body>']
+    for chart in BATCH_CHARTS:
+        files = sorted(os.path.relpath(p, out_dir) for p in paths if os.path.basename(os.path.dirname(p)) == chart)
+        if files:
+            html.append(f'<h2>{chart}</h2>')
+            html += [f'<p><a href="{f}">{f}</a></p>' if f.endswith('.html')
+                     else f'<figure><img src="{f}" style="max-width:100%"><figcaption>{f}</figcaption></figure>'
+                     for f in files]
+    html.append('</body></html>')
+    with open(os.path.join(out_dir, 'index.html'), 'w') as fh:
+        fh.write('\n'.join(html))
+
+# ----------------------------
+# Entry point
+# ----------------------------
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Render every chart variant to PNG / HTML.')
+    parser.add_argument('--data-path', required=True, help='local copy of the Drive data folder')
+    parser.add_argument('--out', default='report', help='output directory (default: report)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='render processes (default: CPU count)')
+    args = parser.parse_args(argv)
+
+    global data_path, monetization_plan
+    data_path = os.path.abspath(args.data_path)
+    for cell in BATCH_CELLS:
+        batch_cell(cell, BATCH_PARAMS)
+    monetization_plan = read_dataset('monetization_plan') if dataset_available('monetization_plan') \
+        else pd.DataFrame({'promo_date': pd.Series(dtype='datetime64[ns]'), 'main_story': pd.Series(dtype=object)})
+
+    t0 = time.perf_counter()
+    for name, (fn, datasets) in BATCH_STAGES.items():
+        pipeline_stage(name, datasets=datasets, params=batch_qs)(fn)
+    BATCH_DATA.update(run_pipeline(list(BATCH_STAGES)))
+    BATCH_DATA['story_firsts'] = story_firsts()
+    tasks = batch_tasks()
+    print(f'data loaded in {time.perf_counter() - t0:.1f}s; rendering {len(tasks)} chart(s)')
+
+    t0 = time.perf_counter()
+    paths, failed = [], 0
+    # fork: workers inherit BATCH_DATA as it is (copy-on-write), only the task tuples are sent
+    if args.workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            futures = {pool.submit(batch_render, args.out, *task): task for task in tasks}
+            for future in as_completed(futures):
+                try:
+                    paths.append(future.result())
+                except Exception as e:
+                    failed += 1
+                    print(f'{futures[future][0]}/{futures[future][1]} failed: {e!r}')
+    else:
+        for task in tasks:
+            try:
+                paths.append(batch_render(args.out, *task))
+            except Exception as e:
+                failed += 1
+                print(f'{task[0]}/{task[1]} failed: {e!r}')
+    batch_index(args.out, paths)
+    print(f'rendered {len(paths)} chart(s) in {time.perf_counter() - t0:.1f}s'
+          + (f', {failed} failed' if failed else '') + f" -> {os.path.join(args.out, 'index.html')}")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
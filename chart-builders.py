@@ -0,0 +1,300 @@
+#@title Chart Builders (chart data and figures shared by the analysis cells and batch-report.py)
+# Run after plot-renderer.py. Every chart is built here once: the analysis cells call these
+# functions from their pipeline stages and widget handlers, and batch-report.py calls the same
+# ones for each variant it renders, so the notebook and the report can't drift apart.
+# The per-day and per-event aggregates are kept by derived-table-store.py, which recomputes
+# only the partitions that changed (energy percentiles come straight from the Snowflake
+# summary when energy_quantiles is stored), and the cells call them from pipeline-runner.py
+# stages that re-run only when their data or settings change.
+#   data      energy_percentiles, percentile_slice, campaign_starts, story_firsts,
+#             event_shares, mb_position_percentiles, puzzle_max_levels
+#   figures   chart_energy, chart_mb_trend, chart_puzzle_levels / chart_puzzle_clear
+#             (draw on a plot-renderer.py view; the caller renders or saves it),
+#             chart_mb_scatter, chart_dice_bars (return a Plotly figure)
+import matplotlib
+import matplotlib.dates as mdates
+import matplotlib.ticker as mticker
+import numpy as np
+import pandas as pd
+
+def percentile_labels(qs) -> dict:
+    return {q: f"{int(q*100)}th percentile" for q in qs}
+
+# ----------------------------
+# Chart data
+# ----------------------------
+def energy_percentiles(table: str, columns, qs) -> dict:
+    """{column: daily percentile frame} of player_balance columns (index is_payer × promo_date).
+
+    Read from the Snowflake summary (energy_quantiles) when it is stored; otherwise computed by
+    agg_daily_quantiles and kept per promo_date in derived table `table` (derived-table-store.py).
+    """
+    if dataset_available('energy_quantiles'):
+        summary = load_dataset('energy_quantiles')
+        return {col: summary_daily_quantiles(summary, col, qs) for col in columns}
+    compute = lambda dates=None: agg_daily_quantiles('player_balance', list(columns), qs, dates=dates)
+    try:
+        return derived_table(table, 'player_balance', compute, params=qs)
+    except NameError:
+        return compute()
+
+def percentile_slice(qframe, is_payer, start=None, end=None, qs=()) -> pd.DataFrame:
+    """Rows of one is_payer segment ('All', 0 or 1) of a percentile frame, between start and end."""
+    if qframe is None or is_payer not in qframe.index.get_level_values(0):
+        return pd.DataFrame(columns=list(qs))
+    frame = qframe.xs(is_payer, level='is_payer')
+    if start: frame = frame.loc[pd.Timestamp(start):]
+    if end:   frame = frame.loc[:pd.Timestamp(end)]
+    return frame
+
+def campaign_starts(dates) -> pd.DataFrame:
+    """Covered days (promo_date, main_story) where a campaign starts: main_story is set and
+    differs from the previous covered day (monetization plan, plan_lookup)."""
+    camp = plan_lookup(dates, ['main_story'])
+    prev = camp['main_story'].shift()
+    return camp[camp['main_story'].notna() & (prev.isna() | (camp['main_story'] != prev))].reset_index(drop=True)
+
+def story_firsts() -> pd.DataFrame:
+    """First appearance of every main_story in the monetization plan (promo_date, main_story);
+    stories debuting on the same day share one ' • '-joined label."""
+    try:
+        src = monetization_plan[['promo_date', 'main_story']].dropna()
+    except NameError:
+        src = pd.DataFrame({'promo_date': pd.Series(dtype='datetime64[ns]'), 'main_story': pd.Series(dtype=object)})
+    src = src.assign(promo_date=pd.to_datetime(src['promo_date']).dt.normalize(),
+                     main_story=src['main_story'].astype(str).str.strip())
+    src = src[src['main_story'] != '']
+    firsts = src.sort_values(['main_story', 'promo_date']).groupby('main_story', as_index=False)['promo_date'].first()
+    return firsts.groupby('promo_date', as_index=False)['main_story'].agg(' • '.join)
+
+def event_shares(source: str, pct_col: str = 'pct_of_total', min_players: int = 1000) -> pd.DataFrame:
+    """Players per (event, position) of a progression source with the event's total_unique_players
+    and each row's % of it (`pct_col`); events with min_players or fewer players are left out."""
+    dist = progression_distribution(source)   # progression-cube.py
+    total = dist.groupby(PROGRESSION_SOURCES[source]['event'])['unique_players'].transform('sum')
+    dist = dist.assign(total_unique_players=total, **{pct_col: dist['unique_players'] / total * 100})
+    return dist[dist['total_unique_players'] > min_players]
+
+def mb_position_percentiles(shares: pd.DataFrame, qs) -> pd.DataFrame:
+    """Weighted last-position percentiles per MB event (index mb_event_start, columns qs) from
+    event_shares('mb'), kept per event in derived table mbp_pct_table."""
+    df = shares[['mb_event_start', 'last_position', 'unique_players']].copy()
+    df['mb_event_start'] = pd.to_datetime(df['mb_event_start']).dt.normalize()
+    df['last_position']  = pd.to_numeric(df['last_position'], errors='coerce')
+    df['unique_players'] = pd.to_numeric(df['unique_players'], errors='coerce')
+    df = df.dropna(subset=['mb_event_start', 'last_position', 'unique_players'])
+    # Collapse duplicates per (event, position) if any
+    df = df.groupby(['mb_event_start', 'last_position'], as_index=False)['unique_players'].sum()
+
+    def compute(events=None):
+        rows = df if events is None else df[df['mb_event_start'].isin(pd.to_datetime(events))]
+        return weighted_quantiles(rows, 'mb_event_start', 'last_position', 'unique_players', qs)
+
+    try:
+        return derived_table('mbp_pct_table', 'mb_progression', compute, params=qs)
+    except NameError:
+        return compute()
+
+def puzzle_max_levels(counts: np.ndarray, configs, levels) -> pd.DataFrame:
+    """Highest level any player of each config reached, from progression_array('puzzle')."""
+    return pd.DataFrame({
+        'puzzle_config_display_name': configs,
+        'max_levels': [levels[np.flatnonzero(lv)[-1]] if lv.any() else np.nan for lv in counts.sum(axis=1) > 0],
+    })
+
+# ----------------------------
+# Matplotlib charts (plot-renderer.py views)
+# ----------------------------
+def chart_energy(view: dict, frames, qs, labels: dict, title: str, ylabel: str, starts: pd.DataFrame):
+    """Daily percentile lines with campaign-start markers (energy-balance / energy-out trends).
+
+    frames: [(label prefix, percentile frame indexed by date, line style)], drawn per
+    percentile then per frame; starts: campaign_starts(), shown within the plotted dates.
+    """
+    ax = view['ax']
+    ax.set_xlabel('Promo Date')
+    ax.set_ylabel(ylabel)
+    ax.grid(True, alpha=0.3)
+    # Weekly ticks on Mondays
+    ax.xaxis.set_major_locator(mdates.WeekdayLocator(byweekday=mdates.MO, interval=1))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+
+    shown = [frame for _, frame, _ in frames if not frame.empty]
+    view_lines(view, [(prefix + labels[q], frame.index, frame[q], style)
+                      for q in qs for prefix, frame, style in frames if q in frame.columns and not frame.empty])
+    ax.set_title(title if shown else "No data for the selected filters")
+    if shown:
+        x_min, x_max = min(f.index.min() for f in shown), max(f.index.max() for f in shown)
+        starts = starts[(starts['promo_date'] >= x_min) & (starts['promo_date'] <= x_max)]
+    else:
+        starts = starts.iloc[:0]
+    view_markers(view, starts['promo_date'], starts['main_story'], y=1, offset=(2, -5),
+                 line_style={'linestyles': ':', 'linewidths': 1, 'alpha': 0.25},
+                 rotation=90, va='top', fontsize=8)
+    view['fig'].autofmt_xdate()
+
+def chart_mb_trend(view: dict, table: pd.DataFrame, qs, labels: dict, firsts: pd.DataFrame):
+    """Weighted last-position percentile lines per MB event with story first-appearance markers."""
+    ax = view['ax']
+    ax.set_xlabel('MB Event Start Date')
+    ax.set_ylabel('Last Position (integer)')
+    ax.grid(True, alpha=0.5)
+    # Y ticks: integer only (no .5)
+    ax.yaxis.set_major_locator(mticker.MaxNLocator(integer=True))
+
+    # Plot selected percentile lines as integers
+    view_lines(view, [(labels[q], table.index, table[q].astype(int), {})
+                      for q in qs if q in table.columns and not table.empty])
+    if table.empty:
+        ax.set_title("No data for the selected range")
+        ax.set_xticks([])
+        firsts = firsts.iloc[:0]
+    else:
+        ax.set_title('Player Last Position — Weighted Percentiles by MB Event Start', pad=100)
+        # X ticks: every actual event date (thin labels if too many)
+        tick_vals = table.index.to_numpy()
+        step = max(1, int(np.ceil(len(tick_vals) / 60)))
+        ax.set_xticks(tick_vals[::step])
+        ax.set_xticklabels([pd.to_datetime(d).strftime('%Y-%m-%d') for d in tick_vals[::step]],
+                           rotation=45, ha='right')
+        firsts = firsts[(firsts['promo_date'] >= pd.Timestamp(table.index.min()).normalize()) &
+                        (firsts['promo_date'] <= pd.Timestamp(table.index.max()).normalize())]
+    view_markers(view, firsts['promo_date'], firsts['main_story'], y=1.01,
+                 line_style={'linestyles': ':', 'linewidths': 1, 'alpha': 0.6},
+                 rotation=90, va='bottom', ha='center')
+
+def _puzzle_axes(ax):
+    ax.set_ylim(0, 100)
+    ax.set_ylabel('% of players')
+    ax.set_xlabel('Event start')
+    ax.grid(axis='y', linestyle=':', linewidth=0.7, alpha=0.7)
+
+def chart_puzzle_clear(view: dict, message: str):
+    """Empty puzzle chart with `message` as its title."""
+    ax = view['ax']
+    _puzzle_axes(ax)
+    view_stacked_bars(view, [], np.zeros((0, 0)), {})
+    view_texts(view, 'segments', [], [], [])
+    ax.set_xticks([])
+    if ax.get_legend() is not None:
+        ax.get_legend().remove()
+    ax.set_title(message)
+
+def chart_puzzle_levels(view: dict, players: np.ndarray, events, levels, title: str, colormap: str = 'viridis',
+                        cmap_span=(0.15, 0.95), label_min_pct: float = 3.0, label_fmt: str = "{:.0f}%",
+                        label_fontsize: int = 9, label_big_cut: float = 12.0):
+    """100% stacked levels-completed bars per puzzle event.
+
+    players: unique players per (event, level) over the selected configs, on the events ×
+    levels axes of progression_array('puzzle'). Segments of at least label_min_pct % are
+    labelled, in white from label_big_cut %.
+    """
+    has_event, has_level = players.sum(axis=1) > 0, players.sum(axis=0) > 0
+    if not has_event.any():
+        return chart_puzzle_clear(view, "No data after aggregation.")
+    render_check()   # a newer selection arrived while aggregating: skip drawing this one
+
+    # percent of each event's players, wide (events x levels)
+    players = players[has_event][:, has_level]
+    pct = players / players.sum(axis=1, keepdims=True) * 100
+    dates = events[has_event]
+    level_cols = levels[has_level].tolist()
+
+    # ---- Color scale (sensitive slice of the colormap) ----
+    cmap = matplotlib.colormaps[colormap]
+    samples = np.linspace(cmap_span[0], cmap_span[1], max(1, len(level_cols)))
+    level_colors = {lvl: cmap(s) for lvl, s in zip(level_cols, samples)}
+
+    ax = view['ax']
+    _puzzle_axes(ax)
+    # ---- Stacked 100% bar: one collection, bar geometry and colours updated in place ----
+    handles = view_stacked_bars(view, level_cols, pct, level_colors)
+
+    # Labels for sufficiently large segments (pooled text artists)
+    bottoms = np.cumsum(pct, axis=1) - pct
+    ev_idx, lvl_idx = np.nonzero(pct >= label_min_pct)
+    heights = pct[ev_idx, lvl_idx]
+    view_texts(view, 'segments', ev_idx, bottoms[ev_idx, lvl_idx] + heights / 2.0,
+               [label_fmt.format(h) for h in heights],
+               # choose text color for contrast based on segment size
+               colors=['white' if h >= label_big_cut else 'black' for h in heights],
+               ha='center', va='center', fontsize=label_fontsize)
+
+    ax.set_xticks(np.arange(len(dates)))
+    ax.set_xticklabels([d.strftime('%Y-%m-%d') for d in dates], rotation=45, ha='right')
+    ax.set_title(title)
+    # Legend in level order (lowest at bottom)
+    ax.legend([handles[lvl] for lvl in level_cols], [str(lvl) for lvl in level_cols], title='Levels completed',
+              bbox_to_anchor=(1.02, 1), loc='upper left', frameon=False)
+
+# ----------------------------
+# Plotly charts
+# ----------------------------
+def chart_mb_scatter(shares: pd.DataFrame, firsts: pd.DataFrame, pct_col: str = 'percentage_of_total_players'):
+    """Share of players by last position and MB event start, with story first-appearance markers."""
+    import plotly.express as px
+    shares = shares.assign(mb_event_start=pd.to_datetime(shares['mb_event_start']))
+    # boost marker sensitivity (downweight big values a bit so small ones show up)
+    fig = px.scatter(
+        shares.assign(marker_size=np.power(shares[pct_col].astype(float), 0.75)),
+        x='mb_event_start', y='last_position',
+        size='marker_size',                      # use transformed size
+        color=pct_col,
+        color_continuous_scale="Plasma",         # high-contrast perceptual scale
+        hover_data={'mb_event_start': True, 'last_position': True, 'unique_players': True,
+                    pct_col: ':.2f%', 'marker_size': False},
+        title='Percentage of Unique Players by Last Position and MB Event Start Date',
+        labels={'mb_event_start': 'MB Event Start Date', 'last_position': 'Last Position Reached',
+                pct_col: 'Percentage of Total Players'},
+        size_max=25,
+        render_mode=plotly_render_mode(len(shares)),   # WebGL for large scatters
+    )
+
+    # show ONLY the actual event-start dates as ticks (at most ~50)
+    tick_vals = np.sort(shares['mb_event_start'].dropna().unique())
+    tick_vals = tick_vals[::max(1, int(np.ceil(len(tick_vals) / 50)))]
+    fig.update_xaxes(tickmode='array', tickvals=tick_vals, tickangle=45,
+                     ticktext=[pd.to_datetime(d).strftime('%Y-%m-%d') for d in tick_vals])
+    fig.update_layout(width=2000, height=800, margin=dict(l=50, r=50, t=80, b=80),
+                      coloraxis_colorbar=dict(title="Pct of Total Players", tickformat=".0f"))
+    if shares.empty:
+        return fig
+
+    # clamp color range to the 99th percentile for more contrast
+    fig.update_coloraxes(cmin=0, cmax=float(np.percentile(shares[pct_col], 99)))
+    # story markers within the plotted event range, above the plotting area
+    x_min, x_max = shares['mb_event_start'].min().normalize(), shares['mb_event_start'].max().normalize()
+    firsts = firsts[(firsts['promo_date'] >= x_min) & (firsts['promo_date'] <= x_max)]
+    if not firsts.empty:
+        plotly_date_markers(fig, firsts['promo_date'], firsts['main_story'], y=1.02, shape=dict(opacity=0.45),
+                            textangle=90, yanchor='bottom', font=dict(size=10), opacity=0.9)
+        # headroom so labels don't overlap the title
+        fig.update_layout(margin=dict(l=50, r=50, t=100, b=80))
+    return fig
+
+def chart_dice_bars(shares: pd.DataFrame, pct_col: str = 'pct_of_total'):
+    """100% stacked last-position bars per dice event (central 20-90% of Plasma for contrast)."""
+    import plotly.express as px
+    import plotly.graph_objects as go
+    pivot = shares.pivot_table(index='dice_event_start', columns='last_position',
+                               values=pct_col, fill_value=0).sort_index()
+    plasma = px.colors.sequential.Plasma
+    plasma = plasma[int(len(plasma) * 0.2): int(len(plasma) * 0.9)]
+    dates = [d.strftime('%Y-%m-%d') for d in pivot.index]
+    # One go.Bar per level built directly (no wide-to-long melt), hover limited to date / level / %
+    fig = go.Figure(
+        data=[go.Bar(x=dates, y=pivot[lvl].round(2).to_numpy(), name=str(lvl),
+                     marker=dict(color=plasma[i % len(plasma)]),
+                     hovertemplate=f'%{{x}}<br>Level {lvl}: %{{y:.1f}}%<extra></extra>')
+              for i, lvl in enumerate(pivot.columns)],
+        layout=dict(title='Distribution of Players by Level Completed per DICE Event (High-Contrast Plasma)'),
+    )
+    fig.update_layout(
+        barmode='stack', width=2000, height=800, margin=dict(l=50, r=50, t=80, b=80),
+        xaxis=dict(tickangle=45, title='DICE Event Start Date', type='category'),
+        yaxis=dict(title='Percentage of Total Players', range=[0, 100], ticksuffix='%'),
+        legend_title_text='Level Completed',
+    )
+    return fig
+
+print('Chart builders ready')
@@ -0,0 +1,135 @@
+#@title Dataset Schema Contract (applied at ingest and at parquet load)
+# Run before read-data-from-snowflake.py / read-data-from-parquet.py.
+# Every dataset column gets one "kind"; apply_schema() turns a frame into its compact
+# in-memory form and schema_table() into the fixed Arrow types written to parquet:
+#
+#   kind       in memory                          on disk
+#   id         downcast int, or category          int64 / string
+#   flag       bool                               bool
+#   int        smallest int (float64 if nulls)    int64
+#   category   category                           dictionary<int32, string>
+#   date       datetime64 (midnight)              date32
+#   timestamp  datetime64                         timestamp
+#
+# Dates are native datetime64 after loading, so the analysis cells never re-parse them.
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+monetization_plan_columns = ['special_holiday', 'campaign', 'new_features', 'cycle', 'main_story', 'album', 'puzzle_/_th', 'trail_/_dice', 'theme_path']
+
+DATASET_SCHEMAS = {
+    'player_balance': {
+        'promo_date': 'date', 'promo_day': 'category', 'cycle_name': 'category',
+        'player_id': 'id', 'is_payer': 'flag',
+        'energy_balance_bop': 'int', 'energy_balance_eop': 'int', 'total_energy_out': 'int',
+    },
+    'energy_quantiles': {
+        'promo_date': 'date', 'segment': 'category', 'metric': 'category',
+    },
+    'mb_progression': {
+        'player_id': 'id', 'calendar_id': 'category', 'config_id': 'category', 'is_payer': 'flag',
+        'last_position': 'int', 'mb_event_start': 'date', 'mb_event_end': 'date', 'days_live': 'int',
+    },
+    'dice_progression': {
+        'player_id': 'id', 'calendar_id': 'category', 'config_name': 'category', 'last_position': 'int',
+        'starts_at': 'timestamp', 'ends_at': 'timestamp',
+        'dice_event_start': 'date', 'dice_event_end': 'date',
+    },
+    'puzzle_progression': {
+        'player_id': 'id', 'calendar_id': 'category', 'puzzle_config_display_name': 'category',
+        'config_name': 'category', 'levels_completed': 'int',
+        'starts_at': 'timestamp', 'ends_at': 'timestamp',
+        'puzzle_event_starts_at': 'date', 'puzzle_event_ends_at': 'date',
+    },
+    'monetization_plan': {
+        'promo_date': 'date',
+        **{col: 'category' for col in monetization_plan_columns},
+    },
+    'progression_cube': {
+        'source': 'category', 'event_start': 'date', 'config': 'category', 'position': 'int', 'players': 'int',
+    },
+    'energy_sketches': {
+        'promo_date': 'date', 'is_payer': 'flag', 'metric': 'category', 'bucket': 'int', 'count': 'int',
+    },
+}
+
+_ARROW_TYPES = {
+    'flag': pa.bool_(),
+    'int': pa.int64(),
+    'category': pa.dictionary(pa.int32(), pa.string()),
+    'date': pa.date32(),
+}
+
+def _as_date(s: pd.Series) -> pd.Series:
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # hive partition values (e.g. promo_date=2025-10-01): parse the few categories only
+        cats = pd.to_datetime(s.cat.categories.astype(str))
+        return pd.Series(cats.take(s.cat.codes, allow_fill=True, fill_value=pd.NaT), index=s.index, name=s.name)
+    if pd.api.types.is_datetime64_dtype(s):
+        return s
+    return pd.to_datetime(s).dt.normalize()
+
+def _as_kind(s: pd.Series, kind: str) -> pd.Series:
+    if kind == 'date':
+        return _as_date(s)
+    if kind == 'timestamp':
+        return s if pd.api.types.is_datetime64_any_dtype(s) else pd.to_datetime(s)
+    if kind == 'category':
+        return s if isinstance(s.dtype, pd.CategoricalDtype) else s.astype('category')
+    if kind == 'flag':
+        if pd.api.types.is_bool_dtype(s):
+            return s
+        s = pd.to_numeric(s, errors='coerce')
+        return s.astype(bool) if s.notna().all() else s.astype('boolean')
+    if kind == 'int':
+        return pd.to_numeric(s, errors='coerce', downcast='integer')
+    if kind == 'id':
+        if pd.api.types.is_numeric_dtype(s):
+            return pd.to_numeric(s, downcast='integer')
+        return s if isinstance(s.dtype, pd.CategoricalDtype) else s.astype('category')
+    raise ValueError(f"unknown column kind: {kind}")
+
+def apply_schema(df: pd.DataFrame, name: str) -> pd.DataFrame:
+    """Convert the columns of dataset `name` to their in-memory kinds (in place; returns df)."""
+    for col, kind in DATASET_SCHEMAS[name].items():
+        if col in df.columns:
+            df[col] = _as_kind(df[col], kind)
+    return df
+
+def schema_table(df: pd.DataFrame, name: str) -> pa.Table:
+    """Arrow table with the on-disk types of dataset `name` (stable across batches and partitions)."""
+    table = pa.Table.from_pandas(apply_schema(df, name), preserve_index=False)
+    for col, kind in DATASET_SCHEMAS[name].items():
+        if col not in table.column_names:
+            continue
+        current = table.schema.field(col).type
+        if kind == 'id':
+            value_type = current.value_type if pa.types.is_dictionary(current) else current
+            target = pa.int64() if pa.types.is_integer(value_type) else pa.string()
+        else:
+            target = _ARROW_TYPES.get(kind)
+        if target is not None and current != target:
+            table = table.set_column(table.schema.get_field_index(col), col, table.column(col).cast(target))
+    return table
+
+def read_parquet_with_schema(path: str, name: str, **kwargs) -> pd.DataFrame:
+    """pd.read_parquet for a dataset file/directory, with dates kept as datetime64 and the schema applied."""
+    table = pq.read_table(path, **kwargs)
+    return apply_schema(table.to_pandas(date_as_object=False), name)
+
+def plan_lookup(dates, columns=('main_story',)) -> pd.DataFrame:
+    """Monetization plan attributes for the given promo dates, one row per date.
+
+    The plan is a small dimension table keyed by promo_date (monetization_plan.parquet);
+    analyses join the attributes they need on demand instead of carrying them on every row.
+    """
+    keys = pd.DataFrame({'promo_date': pd.Series(pd.unique(np.asarray(dates))).sort_values(ignore_index=True)})
+    plan = monetization_plan[['promo_date', *columns]].drop_duplicates('promo_date')
+    return keys.merge(plan, on='promo_date', how='left')
+
+def memory_mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / 1024**2
+
+print('Dataset schema contract loaded:', ', '.join(DATASET_SCHEMAS))
@@ -0,0 +1,127 @@
+#@title Derived Table Store (incremental recompute of per-day / per-event aggregates)
+# Run after aggregation-backend.py. Aggregates that are computed independently per partition
+# of a dataset (daily energy percentiles per promo_date, MB position percentiles per event)
+# are kept in derived_tables/<table>.pkl together with a fingerprint of every input partition.
+# derived_table() recomputes only partitions that are new or whose files changed, drops rows
+# of partitions that are gone and reuses everything else, so a daily refresh costs one day.
+#
+# A partition's fingerprint hashes its file names, row counts and a checksum of the bytes of
+# every column chunk - not the footer, which also carries the pandas metadata and writer
+# version. Rewriting identical rows (as the full progression refresh does) keeps the
+# fingerprint; any changed value alters it, even with the same row counts and extremes.
+# Checksums are memoized per file size and mtime, so only rewritten files are read again.
+import hashlib
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+derived_store_enabled = True   #@param {type:"boolean"}
+
+def derived_store_path() -> str:
+    return mirror_local(f"{data_path}/derived_tables")
+
+_digest_memo = {}   # path -> ((inode, size, mtime), digest), so unchanged files are not read again
+
+def _parquet_digest(path: str) -> bytes:
+    """Row counts and a checksum of every column chunk's data pages, per row group."""
+    stat = os.stat(path)
+    version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    memo = _digest_memo.get(path)
+    if memo and memo[0] == version:
+        return memo[1]
+    meta = pq.ParquetFile(path).metadata
+    parts = [meta.num_rows, meta.num_row_groups]
+    with open(path, 'rb') as fh:
+        for i in range(meta.num_row_groups):
+            group = meta.row_group(i)
+            parts.append(group.num_rows)
+            for j in range(group.num_columns):
+                chunk = group.column(j)
+                start = chunk.data_page_offset
+                if chunk.has_dictionary_page and chunk.dictionary_page_offset:
+                    start = min(start, chunk.dictionary_page_offset)
+                fh.seek(start)
+                data = fh.read(chunk.total_compressed_size)
+                parts.append((chunk.path_in_schema, len(data), hashlib.sha256(data).hexdigest()))
+    digest = repr(parts).encode('utf-8')
+    _digest_memo[path] = (version, digest)
+    return digest
+
+def partition_fingerprints(name: str) -> dict:
+    """{partition date: fingerprint} of a partitioned dataset's stored partitions."""
+    path, col = dataset_path(name), DATASET_LAYOUTS[name]['partition']
+    out = {}
+    for d in stored_partitions(name):
+        part = f"{path}/{col}={d.isoformat()}"
+        digest = hashlib.sha256()
+        for f in sorted(os.listdir(part)):
+            if f.startswith('.') or not f.endswith('.parquet'):
+                continue
+            digest.update(f"{f}:".encode('utf-8'))
+            digest.update(_parquet_digest(f'{part}/{f}'))
+        out[d] = digest.hexdigest()
+    return out
+
+def _partition_dates(frame: pd.DataFrame, col: str) -> pd.Series:
+    values = frame.index.get_level_values(col) if col in frame.index.names else frame[col]
+    return pd.Series(pd.to_datetime(values).date, index=frame.index)
+
+def derived_table(table: str, source: str, compute, params=None):
+    """Result of compute(dates) over every partition of `source`, recomputing only what changed.
+
+    compute(dates) gets a sorted list of partition dates (None: everything, for a source still in
+    the single-file layout) and returns a frame - or {key: frame} -
+    whose rows carry the partition date in an index level or column named like the partition
+    column. `params` (anything picklable, e.g. the percentiles) invalidates the whole table
+    when it changes. Returns the same shape compute() returns, rows sorted by index.
+    """
+    col = DATASET_LAYOUTS[source]['partition']
+    mirror_pull(dataset_path(source))
+    current = partition_fingerprints(source)
+    if not current:
+        return compute(None)   # single file saved before the partitioned layout: no partitions to reuse
+    if not derived_store_enabled:
+        return compute(sorted(current))
+
+    store_dir = derived_store_path()
+    store_file = f"{store_dir}/{table}.pkl"
+    mirror_pull(store_dir)
+    try:
+        stored = pd.read_pickle(store_file)
+        if stored['source'] != source or stored['params'] != params:
+            stored = None
+    except (FileNotFoundError, EOFError, KeyError):
+        stored = None
+    old = stored['frames'] if stored else {}
+    known = stored['partitions'] if stored else {}
+
+    changed = sorted(d for d, fp in current.items() if known.get(d) != fp)
+    stale = (set(known) - set(current)) | set(changed)
+    if stored and not stale:
+        return old[None] if list(old) == [None] else old
+
+    if changed:
+        fresh = compute(changed)
+        single = not isinstance(fresh, dict)
+        fresh = {None: fresh} if single else fresh
+    else:
+        fresh, single = {}, list(old) == [None]
+    frames = {}
+    for key in list(dict.fromkeys([*old, *fresh])):
+        kept = old.get(key)
+        if kept is not None:
+            kept = kept[~_partition_dates(kept, col).isin(stale).to_numpy()]
+        parts = [f for f in (kept, fresh.get(key)) if f is not None]
+        parts = [f for f in parts if len(f)] or parts[:1]
+        frames[key] = pd.concat(parts).sort_index() if len(parts) > 1 else parts[0]
+
+    os.makedirs(store_dir, exist_ok=True)
+    tmp = f"{store_dir}/.{table}.pkl.tmp"
+    pd.to_pickle({'source': source, 'params': params, 'partitions': current, 'frames': frames}, tmp)
+    os.replace(tmp, store_file)
+    mirror_push(store_dir)
+    print(f'{table}: recomputed {len(changed)} of {len(current)} {col} partition(s)')
+    return frames[None] if single else frames
+
+print('Derived table store ' + ('enabled' if derived_store_enabled else 'disabled'))
@@ -3,47 +3,42 @@
 # ----------------------------
 # One-time preprocess (namespaced)
 # ----------------------------
-bep_df = player_balance.copy()
-bep_df['promo_date'] = pd.to_datetime(bep_df['promo_date']).dt.normalize()
-
 bep_qs = [0.5, 0.75, 0.9, 0.95, 0.99]
-bep_q_labels = {q: f"{int(q*100)}th percentile" for q in bep_qs}
-
-def bep_compute_quantiles(col: str):
-    if col not in bep_df.columns:
-        return None
-    by_payer = (
-        bep_df.groupby(['is_payer','promo_date'])[col]
-              .quantile(q=bep_qs).unstack()
-              .rename_axis(index=['is_payer','promo_date'], columns='q')
-    )
-    overall = (
-        bep_df.groupby('promo_date')[col]
-              .quantile(q=bep_qs).unstack()
-              .rename_axis(index='promo_date', columns='q')
-    )
-    overall.index = pd.MultiIndex.from_product(
-        [['All'], overall.index], names=['is_payer','promo_date']
-    )
-    return pd.concat([overall, by_payer]).sort_index()
-
-bep_quantiles_eop = bep_compute_quantiles("energy_balance_eop")
-bep_quantiles_bop = bep_compute_quantiles("energy_balance_bop")
-
-# Campaign start detection (namespaced)
-bep_camp = (
-    bep_df[['promo_date','main_story']]
-    .drop_duplicates('promo_date')
-    .sort_values('promo_date')
-)
-bep_prev = bep_camp['main_story'].shift()
-bep_campaign_starts = bep_camp[
-    (bep_camp['main_story'].notna()) &
-    ((bep_prev.isna()) | (bep_camp['main_story'] != bep_prev))
-].reset_index(drop=True)
-
-bep_min_date = bep_df['promo_date'].min().date() if not bep_df.empty else date.today()
-bep_max_date = bep_df['promo_date'].max().date() if not bep_df.empty else date.today()
+bep_q_labels = percentile_labels(bep_qs)
+
+# Daily percentiles of both columns, overall and per payer (chart-builders.py)
+@pipeline_stage('bep_quantiles', datasets=['player_balance', 'energy_quantiles'], params=bep_qs)
+def bep_quantiles_stage():
+    return energy_percentiles('bep_quantiles', ['energy_balance_eop', 'energy_balance_bop'], bep_qs)
+
+bep_quantiles = run_pipeline(['bep_quantiles'])['bep_quantiles']
+bep_quantiles_eop = bep_quantiles['energy_balance_eop']
+bep_quantiles_bop = bep_quantiles['energy_balance_bop']
+bep_dates = bep_quantiles_eop.index.get_level_values('promo_date').to_series()
+
+# Campaign start detection (namespaced): main_story per covered day from the plan dimension
+bep_campaign_starts = campaign_starts(bep_dates.unique())
+
+bep_min_date = bep_dates.min().date() if not bep_dates.empty else date.today()
+bep_max_date = bep_dates.max().date() if not bep_dates.empty else date.today()
+
+# Weekly / monthly views merge the stored per-day sketches (quantile-sketches.py), if present
+try:
+    bep_granularities = {'Daily': None, 'Weekly': 'W', 'Monthly': 'M'} \
+        if sketch_enabled and dataset_available('energy_sketches') else {'Daily': None}
+except NameError:
+    bep_granularities = {'Daily': None}
+bep_sketched = {}
+
+def bep_frames_for(granularity):
+    """(EOP frame, BOP frame, sketch relative error or None when exact) for a granularity."""
+    freq = bep_granularities[granularity]
+    if freq is None:
+        return bep_quantiles_eop, bep_quantiles_bop, None
+    if freq not in bep_sketched:
+        bep_sketched[freq] = sketch_quantiles(['energy_balance_eop', 'energy_balance_bop'], bep_qs, freq)
+    sketched = bep_sketched[freq]
+    return sketched['energy_balance_eop'], sketched['energy_balance_bop'], sketched['energy_balance_eop'].attrs['relative_error']
 
 # ----------------------------
 # Widgets (namespaced)
@@ -55,96 +50,41 @@ bep_w_percentiles = widgets.SelectMultiple(
     layout=widgets.Layout(width='260px')
 )
 bep_w_payer = widgets.Dropdown(options=['All', 0, 1], value='All', description='Is Payer:')
+bep_w_granularity = widgets.Dropdown(options=list(bep_granularities), value='Daily', description='Granularity:')
 bep_w_start = widgets.DatePicker(description='Start', value=bep_min_date)
 bep_w_end   = widgets.DatePicker(description='End',   value=bep_max_date)
 bep_w_update = widgets.Button(description='Update', button_style='primary')
-bep_controls = widgets.HBox([bep_w_percentiles, bep_w_payer, bep_w_start, bep_w_end, bep_w_update])
+bep_controls = widgets.HBox([bep_w_percentiles, bep_w_payer, bep_w_granularity, bep_w_start, bep_w_end, bep_w_update])
 
-# Single controlled output area (namespaced)
-bep_out = widgets.Output()
+# One persistent figure, updated in place on every Update (plot-renderer.py)
+bep_view = render_view('bep', figsize=(20, 6))
 
 def bep_parse_qs(sel):
     if ('All' in sel) or (len(sel) == 0):
         return bep_qs
     return [float(s.split('th')[0]) / 100 for s in sel]
 
-def bep_slice(is_payer, start_d, end_d, qframe):
-    if qframe is None:
-        return pd.DataFrame(columns=bep_qs)
-    if is_payer not in qframe.index.get_level_values(0):
-        return pd.DataFrame(columns=bep_qs)
-    frame = qframe.xs(is_payer, level='is_payer')
-    if start_d: frame = frame.loc[pd.Timestamp(start_d):]
-    if end_d:   frame = frame.loc[:pd.Timestamp(end_d)]
-    return frame
-
 # ----------------------------
 # Update (plots EOP solid, BOP dashed + campaign markers) — namespaced
 # ----------------------------
 def bep_update_plot(*_):
-    frame_eop = bep_slice(bep_w_payer.value, bep_w_start.value, bep_w_end.value, bep_quantiles_eop)
-    frame_bop = bep_slice(bep_w_payer.value, bep_w_start.value, bep_w_end.value, bep_quantiles_bop)
+    qframe_eop, qframe_bop, sketch_error = bep_frames_for(bep_w_granularity.value)
+    frame_eop = percentile_slice(qframe_eop, bep_w_payer.value, bep_w_start.value, bep_w_end.value, bep_qs)
+    frame_bop = percentile_slice(qframe_bop, bep_w_payer.value, bep_w_start.value, bep_w_end.value, bep_qs)
     sel_qs = bep_parse_qs(bep_w_percentiles.value)
 
-    # Filter campaign starts to the selected window
-    start_d = pd.Timestamp(bep_w_start.value) if bep_w_start.value else None
-    end_d   = pd.Timestamp(bep_w_end.value)   if bep_w_end.value   else None
-    camp_window = bep_campaign_starts.copy()
-    if start_d is not None:
-        camp_window = camp_window[camp_window['promo_date'] >= start_d]
-    if end_d is not None:
-        camp_window = camp_window[camp_window['promo_date'] <= end_d]
-
-    with bep_out:
-        bep_out.clear_output(wait=True)
-        fig, ax = plt.subplots(figsize=(20, 6))
-
-        if frame_eop.empty and frame_bop.empty:
-            ax.set_title("No data for the selected filters")
-            ax.set_xlabel("Promo Date"); ax.set_ylabel("Balance")
-            ax.grid(True, alpha=0.3)
-            ax.xaxis.set_major_locator(mdates.WeekdayLocator(byweekday=mdates.MO, interval=1))
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-            fig.autofmt_xdate()
-            # Draw campaign markers even if no lines (optional)
-            for _, row in camp_window.iterrows():
-                ax.axvline(row['promo_date'], linestyle=':', linewidth=1, alpha=0.25)
-                ax.annotate(str(row['main_story']), xy=(row['promo_date'], 1), xycoords=('data', 'axes fraction'),
-                            xytext=(2, -5), textcoords='offset points', rotation=90, va='top', fontsize=8)
-            plt.show()
-            return
-
-        used = False
-        for q in sel_qs:
-            if q in frame_eop.columns:
-                ax.plot(frame_eop.index, frame_eop[q], label=f"eop {bep_q_labels[q]}", linestyle='-')
-                used = True
-            if q in frame_bop.columns:
-                ax.plot(frame_bop.index, frame_bop[q], label=f"bop {bep_q_labels[q]}", linestyle='--')
-                used = True
-
-        ax.set_xlabel('Promo Date')
-        ax.set_ylabel('Balance')
-        ax.set_title('Balance BOP vs EOP Percentiles Over Time')
-        ax.grid(True, alpha=0.3)
-
-        # Weekly ticks on Mondays
-        ax.xaxis.set_major_locator(mdates.WeekdayLocator(byweekday=mdates.MO, interval=1))
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-        fig.autofmt_xdate()
-
-        # Campaign markers & labels
-        for _, row in camp_window.iterrows():
-            ax.axvline(row['promo_date'], linestyle=':', linewidth=1, alpha=0.25)
-            ax.annotate(str(row['main_story']), xy=(row['promo_date'], 1), xycoords=('data', 'axes fraction'),
-                        xytext=(2, -5), textcoords='offset points', rotation=90, va='top', fontsize=8)
+    render_check()   # superseded by a newer Update while slicing: stop here (plot-renderer.py)
 
-        if used:
-            ax.legend()
-        plt.show()
+    # EOP solid, BOP dashed; lines keep their artist (and colour) across updates (chart-builders.py)
+    chart_energy(bep_view, [('eop ', frame_eop, {'linestyle': '-'}), ('bop ', frame_bop, {'linestyle': '--'})],
+                 sel_qs, bep_q_labels,
+                 'Balance BOP vs EOP Percentiles Over Time'
+                 + (f' ({bep_w_granularity.value.lower()}, sketch ±{sketch_error:.0%})' if sketch_error else ''),
+                 'Balance', bep_campaign_starts)
+    view_render(bep_view)
 
-# Wire button (namespaced)
-bep_w_update.on_click(bep_update_plot)
+# Wire button (namespaced): redraws run in the background, repeated clicks collapse into one
+bep_w_update.on_click(lambda _: render_later('bep', bep_update_plot))
 
-display(bep_controls, bep_out)
+display(bep_controls, bep_view['widget'])
 bep_update_plot()
@@ -0,0 +1,540 @@
+#@title Parquet Storage Layout (partitioned, sorted, zstd datasets)
+# Run after data-schema.py and before read-data-from-snowflake.py / read-data-from-parquet.py.
+# Balances are partitioned by promo_date and progression datasets by event start, rows are
+# sorted inside each partition, and files are zstd-compressed with row-group min/max
+# statistics, so readers only open the partitions, row groups and columns they ask for.
+# The small tables (energy_quantiles, monetization_plan) stay single files.
+# Analyses fetch data with load_dataset(name, columns, start, end), which reads lazily.
+#
+# Drive is a FUSE mount and much slower than the VM's local disk, so with mirror_enabled the
+# datasets are read and written in a local copy under mirror_root: reads first pull only the
+# files whose Drive size/mtime differ from the mirror manifest, and writes are copied to Drive
+# by a background thread (mirror_flush() waits for them).
+# With hot_cache_enabled every (partition, column set) a reader asks for is also kept as an
+# uncompressed, memory-mapped Arrow file, so reloading it after a kernel restart skips parquet
+# decoding (the pandas conversion still copies); only the requested columns and partitions
+# are ever read or cached, and the cache is held under hot_cache_max_gb.
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+parquet_compression_level = 6           # zstd: 1-3 faster writes, 9+ smaller files
+parquet_row_group_rows    = 1_000_000   # rows per row group (one min/max statistics block)
+mirror_enabled = True                        #@param {type:"boolean"}
+mirror_root    = '/content/parquet_mirror'   #@param {type:"string"}
+hot_cache_enabled = True                       #@param {type:"boolean"}
+hot_cache_dir     = '/content/arrow_hot_cache'  #@param {type:"string"}
+hot_cache_max_gb  = 20                          #@param {type:"number"}  # least recently read files go first
+
+DATASET_LAYOUTS = {
+    'player_balance':     {'partition': 'promo_date',             'sort': ['is_payer', 'player_id']},
+    'mb_progression':     {'partition': 'mb_event_start',         'sort': ['config_id', 'last_position', 'player_id']},
+    'dice_progression':   {'partition': 'dice_event_start',       'sort': ['config_name', 'last_position', 'player_id']},
+    'puzzle_progression': {'partition': 'puzzle_event_starts_at', 'sort': ['puzzle_config_display_name', 'levels_completed', 'player_id']},
+    'energy_quantiles':   {'partition': None,                     'sort': ['promo_date', 'metric', 'segment']},
+    'monetization_plan':  {'partition': None,                     'sort': ['promo_date']},
+    'progression_cube':   {'partition': None,                     'sort': ['source', 'event_start', 'config', 'position']},
+    'energy_sketches':    {'partition': 'promo_date',             'sort': ['metric', 'is_payer', 'bucket']},
+}
+
+def drive_path(name: str) -> str:
+    """Directory of a partitioned dataset, or the .parquet file of a single-file one (under data_path)."""
+    suffix = '' if DATASET_LAYOUTS[name]['partition'] else '.parquet'
+    return f"{data_path}/{name}{suffix}"
+
+def dataset_path(name: str) -> str:
+    """Where a dataset is read and written: its local mirror when enabled, else the Drive copy."""
+    return mirror_local(drive_path(name))
+
+def staging_path(name: str) -> str:
+    return dataset_path(name) + '.staging'
+
+def sort_for_layout(df: pd.DataFrame, name: str) -> pd.DataFrame:
+    """Order rows by partition column then the layout's sort keys (tight row-group statistics)."""
+    layout = DATASET_LAYOUTS[name]
+    keys = [c for c in [layout['partition'], *layout['sort']] if c and c in df.columns]
+    return df.sort_values(keys, ignore_index=True) if keys else df
+
+def _partitioning(name: str, schema: pa.Schema):
+    col = DATASET_LAYOUTS[name]['partition']
+    return ds.partitioning(pa.schema([schema.field(col)]), flavor='hive')
+
+def _file_options():
+    return ds.ParquetFileFormat().make_write_options(
+        compression='zstd', compression_level=parquet_compression_level, write_statistics=True
+    )
+
+def parquet_writer(path: str, schema: pa.Schema) -> pq.ParquetWriter:
+    """Incremental single-file writer (each write_table call becomes a row group)."""
+    return pq.ParquetWriter(path, schema, compression='zstd',
+                            compression_level=parquet_compression_level, write_statistics=True)
+
+def write_partitions(table: pa.Table, name: str, path: str, basename_template: str = 'part-{i}.parquet'):
+    """Append an Arrow table to the hive-partitioned dataset at `path`."""
+    ds.write_dataset(
+        table, path, format='parquet',
+        partitioning=_partitioning(name, table.schema),
+        file_options=_file_options(),
+        basename_template=basename_template,
+        existing_data_behavior='overwrite_or_ignore',
+        max_rows_per_group=parquet_row_group_rows,
+    )
+
+def write_dataset(df: pd.DataFrame, name: str, path: str = None):
+    """Sort, type (data-schema.py) and write `df` in the dataset's layout; returns the path written."""
+    table = schema_table(sort_for_layout(df, name), name)
+    if DATASET_LAYOUTS[name]['partition']:
+        path = path or staging_path(name)
+        write_partitions(table, name, path)
+    else:
+        path = path or dataset_path(name)
+        pq.write_table(table, path + '.tmp', compression='zstd', compression_level=parquet_compression_level,
+                       row_group_size=parquet_row_group_rows, write_statistics=True)
+        os.replace(path + '.tmp', path)
+        mirror_push(path)
+    return path
+
+def commit_staging(name: str, partitions_only: bool = False) -> int:
+    """Move a staged partitioned write into place; returns the number of partitions moved.
+
+    By default the staged dataset replaces the current one; with partitions_only only the
+    staged partitions are swapped in and every other stored partition is kept.
+    """
+    target, staged_root = dataset_path(name), staging_path(name)
+    staged = sorted(p for p in os.listdir(staged_root) if '=' in p) if os.path.isdir(staged_root) else []
+    if not partitions_only:
+        shutil.rmtree(target, ignore_errors=True)
+    os.makedirs(target, exist_ok=True)
+    for part in staged:
+        shutil.rmtree(f"{target}/{part}", ignore_errors=True)
+        shutil.move(f"{staged_root}/{part}", f"{target}/{part}")
+    shutil.rmtree(staged_root, ignore_errors=True)
+    mirror_push(target)
+    return len(staged)
+
+def stored_partitions(name: str) -> list:
+    """Sorted partition dates present in a partitioned dataset (null partitions excluded)."""
+    path, col = dataset_path(name), DATASET_LAYOUTS[name]['partition']
+    if not os.path.isdir(path):
+        return []
+    return sorted(
+        pd.Timestamp(part.split('=', 1)[1]).date()
+        for part in os.listdir(path)
+        if part.startswith(col + '=') and not part.endswith('__HIVE_DEFAULT_PARTITION__')
+    )
+
+def drop_partitions(name: str, dates):
+    """Remove the given partition dates from a partitioned dataset (queues the Drive upload)."""
+    path, col = dataset_path(name), DATASET_LAYOUTS[name]['partition']
+    for d in dates:
+        shutil.rmtree(f"{path}/{col}={d.isoformat()}", ignore_errors=True)
+    mirror_push(path)
+
+def delete_dataset(name: str):
+    """Remove a dataset (local mirror and Drive copy)."""
+    path = dataset_path(name)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+    mirror_push(path)
+
+def read_dataset(name: str, columns=None, filters=None, hot_cache=None) -> pd.DataFrame:
+    """Read a dataset with column projection and partition/row-group pruning (pyarrow filters).
+
+    hot_cache=False reads the parquet directly, e.g. for one-off chunked scans whose column set
+    is not worth caching (default: hot_cache_enabled).
+    """
+    path = dataset_path(name)
+    kwargs = {}
+    col = DATASET_LAYOUTS[name]['partition']
+    if col and not os.path.isdir(drive_path(name)) and os.path.exists(drive_path(name) + '.parquet'):
+        path += '.parquet'   # single file saved before the partitioned layout
+    elif col:
+        # typed hive partitioning: partition values come back as date32 (null event starts too)
+        kwargs['partitioning'] = ds.partitioning(pa.schema([(col, pa.date32())]), flavor='hive')
+    mirror_pull(path)
+    if (hot_cache_enabled if hot_cache is None else hot_cache):
+        filter_columns = [f[0] for f in filters or ()]
+        read_columns = None if columns is None else list(dict.fromkeys([*columns, *filter_columns]))
+        table = hot_cache_table(name, path, read_columns, filters, **kwargs)
+        if filters:
+            table = table.filter(pq.filters_to_expression(filters))   # row level, within the partitions
+        if columns is not None:
+            table = table.select(columns)
+        return apply_schema(table.to_pandas(split_blocks=True, date_as_object=False), name)
+    return read_parquet_with_schema(path, name, columns=columns, filters=filters, **kwargs)
+
+# ----------------------------
+# Local mirror of the Drive datasets
+# ----------------------------
+# The manifest records, per file, the size and mtime of both copies as of the last sync;
+# a file is copied again only when either side no longer matches it. A push uploads a
+# hard-linked snapshot of the local tree taken when it is queued (writers replace files,
+# never rewrite them in place), so later commits to the same path cannot change a running
+# upload. Pushes of a path still waiting in the queue collapse into one with the newest snapshot.
+_mirror_uploads = ThreadPoolExecutor(max_workers=1)   # one writer keeps Drive uploads ordered
+_mirror_pending = {}                                  # local path -> Future of its latest upload
+_mirror_queued = {}                                   # local path -> snapshot no upload has taken yet
+_mirror_pending_lock = threading.Lock()
+_mirror_snapshot_ids = itertools.count()
+_mirror_pull_lock = threading.Lock()                  # cells may load datasets from several threads
+
+def mirror_local(path: str) -> str:
+    """Local mirror path for a path under data_path (the path itself when the mirror is off)."""
+    return mirror_root + path[len(data_path):] if mirror_enabled else path
+
+def _mirror_drive(path: str) -> str:
+    return data_path + path[len(mirror_root):]
+
+def _mirror_join(root: str, rel: str) -> str:
+    return os.path.join(root, rel) if rel else root
+
+def _file_stats(root: str) -> dict:
+    """{relative path: (size, mtime_ns)} of a single file ('' key) or of a directory tree."""
+    if os.path.isfile(root):
+        st = os.stat(root)
+        return {'': (st.st_size, st.st_mtime_ns)}
+    stats = {}
+    for dirpath, _, files in os.walk(root):
+        for f in files:
+            if f.startswith('.'):
+                continue   # in-flight copies
+            st = os.stat(os.path.join(dirpath, f))
+            stats[os.path.relpath(os.path.join(dirpath, f), root)] = (st.st_size, st.st_mtime_ns)
+    return stats
+
+def _manifest_file(path: str) -> str:
+    return os.path.join(mirror_root, '.manifest', os.path.relpath(path, mirror_root) + '.json')
+
+def _sync(src: str, dst: str, manifest: dict, src_side: str, dst_side: str) -> int:
+    """Make dst a copy of src, copying only files that changed since the manifest; returns #copied."""
+    src_files, dst_files = _file_stats(src), _file_stats(dst)
+    for rel in set(dst_files) - set(src_files):
+        os.remove(_mirror_join(dst, rel))
+        manifest.pop(rel, None)
+    if os.path.isdir(dst) and '' in src_files:
+        shutil.rmtree(dst)   # a directory is being replaced by a single file
+    if os.path.isdir(dst):
+        for dirpath, _, _ in sorted(os.walk(dst), reverse=True):   # drop emptied partitions
+            if dirpath != dst and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+    copied = 0
+    for rel, stat in src_files.items():
+        entry = manifest.get(rel, {})
+        if tuple(entry.get(src_side, ())) == stat and tuple(entry.get(dst_side, ())) == dst_files.get(rel):
+            continue
+        target = _mirror_join(dst, rel)
+        tmp = os.path.join(os.path.dirname(target), '.' + os.path.basename(target) + '.tmp')
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(_mirror_join(src, rel), tmp)
+        os.replace(tmp, target)
+        st = os.stat(target)
+        manifest[rel] = {src_side: list(stat), dst_side: [st.st_size, st.st_mtime_ns]}
+        copied += 1
+    return copied
+
+def _mirror_sync(path: str, direction: str, snapshot: str = None) -> int:
+    manifest_file = _manifest_file(path)
+    try:
+        with open(manifest_file) as fh:
+            manifest = {rel: {side: tuple(v) for side, v in e.items()} for rel, e in json.load(fh).items()}
+    except FileNotFoundError:
+        manifest = {}
+    if direction == 'pull':
+        copied = _sync(_mirror_drive(path), path, manifest, 'drive', 'local')
+    else:
+        copied = _sync(snapshot or path, _mirror_drive(path), manifest, 'local', 'drive')
+    os.makedirs(os.path.dirname(manifest_file), exist_ok=True)
+    with open(manifest_file, 'w') as fh:
+        json.dump(manifest, fh)
+    return copied
+
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)   # shares the file (same size and mtime for the manifest)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def _mirror_snapshot(path: str) -> str:
+    """Hard-linked copy of the local file or tree at `path` as it is now."""
+    snapshot = os.path.join(mirror_root, '.snapshots', f"{next(_mirror_snapshot_ids)}-{os.path.basename(path)}")
+    os.makedirs(os.path.dirname(snapshot), exist_ok=True)
+    if os.path.isfile(path):
+        _link_or_copy(path, snapshot)
+        return snapshot
+    os.makedirs(snapshot)
+    for rel in _file_stats(path):
+        os.makedirs(os.path.dirname(os.path.join(snapshot, rel)), exist_ok=True)
+        try:
+            _link_or_copy(os.path.join(path, rel), os.path.join(snapshot, rel))
+        except FileNotFoundError:
+            pass   # removed meanwhile; the push that follows the removal drops it on Drive
+    return snapshot
+
+def _remove_snapshot(snapshot: str):
+    if os.path.isdir(snapshot):
+        shutil.rmtree(snapshot, ignore_errors=True)
+    elif os.path.exists(snapshot):
+        os.remove(snapshot)
+
+def _mirror_upload(path: str) -> int:
+    with _mirror_pending_lock:
+        snapshot = _mirror_queued.pop(path)
+    try:
+        return _mirror_sync(path, 'push', snapshot)
+    finally:
+        _remove_snapshot(snapshot)
+
+def mirror_pull(path: str):
+    """Bring the local copy at `path` up to date with Drive (no-op while a local write is uploading)."""
+    if not mirror_enabled:
+        return
+    with _mirror_pending_lock:
+        upload = _mirror_pending.get(path)
+        if upload is not None and not upload.done():
+            return   # the local copy is newer than Drive
+        _mirror_pending.pop(path, None)
+    if upload is not None:
+        upload.result()   # surface a failed upload (earlier ones are covered by this one)
+    with _mirror_pull_lock:
+        copied = _mirror_sync(path, 'pull')
+    if copied:
+        print(f'mirror: copied {copied} changed file(s) of {os.path.basename(path)} from Drive')
+
+def mirror_push(path: str):
+    """Copy the local changes at `path` to Drive in the background."""
+    if not mirror_enabled:
+        return
+    snapshot = _mirror_snapshot(path)
+    with _mirror_pending_lock:
+        replaced = _mirror_queued.get(path)
+        _mirror_queued[path] = snapshot
+        if replaced is None:   # otherwise the queued upload takes the newer snapshot
+            _mirror_pending[path] = _mirror_uploads.submit(_mirror_upload, path)
+    if replaced is not None:
+        _remove_snapshot(replaced)
+
+def mirror_flush():
+    """Wait for every background Drive upload (re-raises the first failure of a path's latest upload)."""
+    with _mirror_pending_lock:
+        uploads = list(_mirror_pending.values())
+        _mirror_pending.clear()
+    errors = [u.exception() for u in uploads]   # waits for each one
+    failed = [e for e in errors if e is not None]
+    if failed:
+        raise failed[0]
+
+# ----------------------------
+# Arrow IPC hot cache
+# ----------------------------
+# One uncompressed Arrow file per (column set, partition) - hot_cache_dir/<dataset>/<column set>/
+# <partition>.arrow - holding exactly the columns a reader projected, plus a fingerprint of that
+# partition's parquet files (paths, sizes, mtimes) in <partition>.arrow.source. An ingest that
+# rewrites one day invalidates that day only. Opening a file is a memory map: columns are paged
+# in on access and the pages are shared through the OS cache, which saves the parquet decode -
+# read_dataset still copies the columns into pandas.
+# Each read of a dataset deletes its cache files whose partition is gone or whose fingerprint
+# changed (in every column set), and touches the .source of the files it used; when the cache
+# grows past hot_cache_max_gb the files read least recently are deleted first.
+_hot_cache_lock = threading.Lock()   # a sweep must not delete a file another reader is rebuilding
+
+def _hot_cache_fingerprint(path: str) -> str:
+    return hashlib.sha256(json.dumps(sorted(_file_stats(path).items())).encode('utf-8')).hexdigest()
+
+def _hot_cache_remove(arrow_file: str):
+    for f in (arrow_file, arrow_file + '.source'):
+        try:
+            os.remove(f)   # open maps of the file stay valid
+        except FileNotFoundError:
+            pass
+
+def _hot_cache_sweep(name: str, path: str):
+    """Delete the cache files of dataset `name` whose source partition (or file) is gone or changed."""
+    root, partitioned, fingerprints = os.path.join(hot_cache_dir, name), os.path.isdir(path), {}
+    for dirpath, _, files in os.walk(root):
+        for f in files:
+            if not f.endswith('.arrow'):
+                continue
+            source = path if f == 'data.arrow' else os.path.join(path, f[:-len('.arrow')])
+            stale = (f == 'data.arrow') == partitioned or not os.path.exists(source)
+            if not stale:
+                if source not in fingerprints:
+                    fingerprints[source] = _hot_cache_fingerprint(source)
+                try:
+                    with open(os.path.join(dirpath, f + '.source')) as fh:
+                        stale = fh.read() != fingerprints[source]
+                except FileNotFoundError:
+                    stale = True
+            if stale:
+                _hot_cache_remove(os.path.join(dirpath, f))
+
+def _hot_cache_trim(keep):
+    """Delete the least recently read cache files until the cache fits hot_cache_max_gb (never `keep`)."""
+    files, total = [], 0
+    for dirpath, _, names in os.walk(hot_cache_dir):
+        for f in names:
+            if f.endswith('.arrow'):
+                arrow_file = os.path.join(dirpath, f)
+                source = arrow_file + '.source'
+                size = os.path.getsize(arrow_file)
+                files.append((os.path.getmtime(source) if os.path.exists(source) else 0, size, arrow_file))
+                total += size
+    limit = hot_cache_max_gb * 1024**3
+    for used, size, arrow_file in sorted(files):
+        if total <= limit:
+            break
+        if arrow_file not in keep:
+            _hot_cache_remove(arrow_file)
+            total -= size
+
+def _hot_cache_file(arrow_file: str, source: str, read):
+    """(memory-mapped copy of the table read() returns, rebuilt?); rebuilt when the parquet at `source` changed."""
+    fingerprint = _hot_cache_fingerprint(source)
+    try:
+        with open(arrow_file + '.source') as fh:
+            current = fh.read() == fingerprint and os.path.exists(arrow_file)
+    except FileNotFoundError:
+        current = False
+    if not current:
+        table = read()
+        os.makedirs(os.path.dirname(arrow_file), exist_ok=True)
+        with pa.OSFile(arrow_file + '.tmp', 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(arrow_file + '.tmp', arrow_file)   # open maps of the old file stay valid
+        with open(arrow_file + '.source', 'w') as fh:
+            fh.write(fingerprint)
+    else:
+        os.utime(arrow_file + '.source')   # last read, for the size cap
+    return pa.ipc.open_file(pa.memory_map(arrow_file)).read_all(), not current
+
+def hot_cache_table(name: str, path: str, columns=None, filters=None, **kwargs) -> pa.Table:
+    """Arrow table (on-disk types) of `columns` of dataset `name` in the partitions `filters` can
+    match, assembled from the memory-mapped cache files and rebuilding those that changed."""
+    column_key = 'all' if columns is None else hashlib.sha256(
+        json.dumps(sorted(columns)).encode('utf-8')).hexdigest()[:16]
+    cache_dir = os.path.join(hot_cache_dir, name, column_key)
+    with _hot_cache_lock:
+        _hot_cache_sweep(name, path)
+        if not os.path.isdir(path):
+            arrow_file = os.path.join(cache_dir, 'data.arrow')
+            table, rebuilt = _hot_cache_file(arrow_file, path, lambda: pq.read_table(path, columns=columns, **kwargs))
+            if rebuilt:
+                _hot_cache_trim({arrow_file})
+            return table
+
+        dataset = ds.dataset(path, format='parquet', **kwargs)
+        parts = {}   # partition directory -> its partition expression
+        for fragment in dataset.get_fragments(filter=pq.filters_to_expression(filters) if filters else None):
+            parts.setdefault(os.path.dirname(fragment.path), fragment.partition_expression)
+        if not parts:
+            return dataset.to_table(columns=columns, filter=pq.filters_to_expression(filters) if filters else None)
+        rebuilt, tables, used = 0, [], set()
+        for part, expression in sorted(parts.items()):
+            arrow_file = os.path.join(cache_dir, os.path.basename(part) + '.arrow')
+            table, fresh = _hot_cache_file(arrow_file, part, lambda: dataset.to_table(columns=columns, filter=expression))
+            rebuilt += fresh
+            tables.append(table)
+            used.add(arrow_file)
+        if rebuilt:
+            print(f'hot cache: cached {rebuilt} partition(s) of {name}')
+            _hot_cache_trim(used)
+    return pa.concat_tables(tables)
+
+# ----------------------------
+# On-demand loading
+# ----------------------------
+# Analyses ask for (dataset, columns, date range); the first request reads only that from
+# parquet and later requests are served from memory while they fit what was loaded.
+_loaded_datasets = {}   # name -> {'df', 'columns' (None = all), 'start', 'end'}
+_load_lock = threading.Lock()   # pipeline stages may load from several threads; one reader at a time
+
+def date_column(name: str):
+    """Column a date range applies to: the partition column, else promo_date."""
+    col = DATASET_LAYOUTS[name]['partition']
+    return col or ('promo_date' if 'promo_date' in DATASET_SCHEMAS[name] else None)
+
+def register_dataset(name: str, df: pd.DataFrame):
+    """Hand a frame already in memory (e.g. fresh from the ingest) to load_dataset."""
+    _loaded_datasets[name] = {'df': df, 'columns': None, 'start': None, 'end': None}
+
+def release_dataset(name: str = None):
+    """Forget a loaded dataset (or all of them) so the next request re-reads parquet."""
+    if name is None:
+        _loaded_datasets.clear()
+    else:
+        _loaded_datasets.pop(name, None)
+
+def dataset_available(name: str) -> bool:
+    if name in _loaded_datasets:
+        return True
+    paths = {dataset_path(name), drive_path(name)}
+    return any(os.path.exists(p) or os.path.exists(p + '.parquet') for p in paths)
+
+def _covers(entry, columns, start, end, date_col) -> bool:
+    if entry['columns'] is not None:
+        needed = set(columns or ()) | ({date_col} if start is not None or end is not None else set())
+        if columns is None or not needed <= set(entry['columns']):
+            return False
+    if entry['start'] is not None and (start is None or start < entry['start']):
+        return False
+    if entry['end'] is not None and (end is None or end > entry['end']):
+        return False
+    return True
+
+def load_dataset(name: str, columns=None, start=None, end=None) -> pd.DataFrame:
+    """Rows of `name` with date_column(name) in [start, end] (inclusive), restricted to `columns`.
+
+    Loads lazily: only the requested columns and partitions are read, and a later request
+    for more columns or a wider range re-reads the union once.
+    """
+    date_col = date_column(name)
+    start = None if start is None else pd.Timestamp(start).normalize()
+    end = None if end is None else pd.Timestamp(end).normalize()
+    ranged = start is not None or end is not None
+    if ranged and date_col is None:
+        raise ValueError(f"{name} has no date column to filter on")
+
+    with _load_lock:
+        entry = _loaded_datasets.get(name)
+        if entry is None or not _covers(entry, columns, start, end, date_col):
+            load_columns, load_start, load_end = columns, start, end
+            if entry is not None:
+                # widen to the union of what was loaded and what is asked for
+                load_columns = None if columns is None or entry['columns'] is None else [*entry['columns'], *columns]
+                load_start = None if start is None or entry['start'] is None else min(start, entry['start'])
+                load_end = None if end is None or entry['end'] is None else max(end, entry['end'])
+            if load_columns is not None and (load_start is not None or load_end is not None):
+                load_columns = [*load_columns, date_col]
+            if load_columns is not None:
+                load_columns = list(dict.fromkeys(load_columns))
+            filters = ([(date_col, '>=', load_start.date())] if load_start is not None else []) + \
+                      ([(date_col, '<=', load_end.date())] if load_end is not None else [])
+            print(f'loading {name}' + (f" ({', '.join(load_columns)})" if load_columns else ''))
+            entry = {'df': read_dataset(name, columns=load_columns, filters=filters or None),
+                     'columns': load_columns, 'start': load_start, 'end': load_end}
+            _loaded_datasets[name] = entry
+
+    df = entry['df']
+    if (start is not None and start != entry['start']) or (end is not None and end != entry['end']):
+        mask = pd.Series(True, index=df.index)
+        if start is not None:
+            mask &= df[date_col] >= start
+        if end is not None:
+            mask &= df[date_col] <= end
+        df = df[mask]
+    if columns is not None and list(columns) != list(df.columns):
+        df = df[list(columns)]
+    return df
+
+print(f'Parquet storage: zstd level {parquet_compression_level}, {parquet_row_group_rows:,} rows per row group'
+      + (f', local mirror at {mirror_root}' if mirror_enabled else ''))
@@ -0,0 +1,215 @@
+#@title Pipeline Runner (named stages, content-hash caching, parallel branches)
+# Run after derived-table-store.py. The analysis cells declare their data stages with
+# @pipeline_stage(name, inputs=[upstream stages], datasets=[stored datasets], params=...) and
+# get the results from run_pipeline([...]) instead of handing globals from cell to cell.
+#
+# A stage's cache key hashes its code, its params, the plain-value globals its code reads
+# (#@param values, quantile lists, thresholds), the session settings in PIPELINE_SETTINGS,
+# the content fingerprints of the datasets it reads (row counts and column chunk checksums
+# per partition, so the ingest invalidates exactly what it rewrote) and the keys of its
+# upstream stages. Globals read only inside the helpers a stage calls are not seen - pass
+# those as params=. run_pipeline() executes only stages whose key changed, running
+# independent branches in parallel threads; the others return the cached value. Stage values
+# are shared between cells - treat them as read-only (copy before editing).
+#
+# With pipeline_persist every stage's key and value are also pickled to pipeline_stages/
+# <stage>.pkl, next to derived_tables/, so after a kernel restart a cell whose inputs did not
+# change loads its value instead of re-running the stage. With pipeline_run_together a cell's
+# request also re-runs every other registered stage whose key changed, in the same parallel
+# pass: after an ingest the first cell re-run refreshes all branches at once and the cells
+# after it hit the cache. A failure in a stage no target needs is printed, not raised.
+import hashlib
+import os
+import pickle
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date
+
+pipeline_workers      = 4      #@param {type:"integer"}
+pipeline_persist      = True   #@param {type:"boolean"}
+pipeline_run_together = True   #@param {type:"boolean"}
+
+PIPELINE_STAGES = {}   # name -> {'fn', 'inputs', 'datasets', 'params'}
+_stage_cache = {}      # name -> (key, value)
+
+# settings read by the helpers every stage goes through (aggregation-backend.py,
+# progression-cube.py, derived-table-store.py); part of every stage key
+PIPELINE_SETTINGS = ['aggregation_engine', 'progression_cube_enabled', 'derived_store_enabled']
+
+def pipeline_stage(name: str, inputs=(), datasets=(), params=None):
+    """Register fn(*upstream values) as stage `name` (re-registering replaces it)."""
+    def register(fn):
+        PIPELINE_STAGES[name] = {'fn': fn, 'inputs': list(inputs), 'datasets': list(datasets), 'params': params}
+        return fn
+    return register
+
+def _code_digest(code, digest):
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode('utf-8'))
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            _code_digest(const, digest)
+        else:
+            digest.update(repr(const).encode('utf-8'))
+
+def _plain(value) -> bool:
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return all(_plain(v) for v in value)
+    if isinstance(value, dict):
+        return all(_plain(k) and _plain(v) for k, v in value.items())
+    return value is None or isinstance(value, (str, bytes, int, float, date))
+
+def _global_names(code) -> set:
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            names |= _global_names(const)
+    return names
+
+def stage_globals(fn) -> dict:
+    """{name: value} of the plain-value globals fn's code (nested lambdas included) reads,
+    plus PIPELINE_SETTINGS; '<unset>' for settings whose cell has not run."""
+    names = sorted(n for n in _global_names(fn.__code__) if n in fn.__globals__ and _plain(fn.__globals__[n]))
+    return {n: fn.__globals__.get(n, '<unset>') for n in dict.fromkeys([*names, *PIPELINE_SETTINGS])}
+
+def dataset_fingerprint(name: str) -> str:
+    """Content fingerprint of a stored dataset ('missing' when there is none)."""
+    path = dataset_path(name)
+    if DATASET_LAYOUTS[name]['partition']:
+        mirror_pull(path)
+        if os.path.isdir(path):
+            return hashlib.sha256(repr(sorted(partition_fingerprints(name).items())).encode('utf-8')).hexdigest()
+        path += '.parquet'   # single file saved before the partitioned layout
+    mirror_pull(path)
+    if not os.path.isfile(path):
+        return 'missing'
+    return hashlib.sha256(_parquet_digest(path)).hexdigest()
+
+def _stage_store() -> str:
+    return mirror_local(f"{data_path}/pipeline_stages")
+
+def _stored_stage(name: str, key: str):
+    """(key, value) of stage `name` as persisted when its key matches `key`, else None."""
+    try:
+        with open(f"{_stage_store()}/{name}.pkl", 'rb') as fh:
+            stored = pickle.load(fh)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+    return (key, stored['value']) if stored.get('key') == key else None
+
+def _persist_stage(name: str, key: str, value) -> bool:
+    store = _stage_store()
+    os.makedirs(store, exist_ok=True)
+    tmp = f"{store}/.{name}.pkl.tmp"
+    try:
+        with open(tmp, 'wb') as fh:
+            pickle.dump({'key': key, 'value': value}, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError) as exc:
+        os.remove(tmp)
+        print(f'pipeline: {name} is kept in memory only ({exc})')
+        return False
+    os.replace(tmp, f"{store}/{name}.pkl")
+    return True
+
+def _upstream(targets) -> list:
+    """Stages needed for `targets`, upstream first."""
+    order, seen = [], set()
+    def visit(name, path=()):
+        if name in path:
+            raise ValueError(f"pipeline cycle: {' -> '.join([*path, name])}")
+        if name in seen:
+            return
+        if name not in PIPELINE_STAGES:
+            raise KeyError(f"unknown pipeline stage: {name} (run the cell that defines it)")
+        for up in PIPELINE_STAGES[name]['inputs']:
+            visit(up, (*path, name))
+        seen.add(name)
+        order.append(name)
+    for t in targets:
+        visit(t)
+    return order
+
+def run_pipeline(targets=None, force=()) -> dict:
+    """{stage: value} for `targets` (default: every stage), running only invalidated stages.
+
+    force: stage names to re-run even when their key is unchanged.
+    """
+    needed = _upstream(list(PIPELINE_STAGES) if targets is None else list(targets))
+    order = _upstream([*needed, *PIPELINE_STAGES]) if pipeline_run_together else needed
+    if pipeline_persist:
+        mirror_pull(_stage_store())
+    datasets = sorted({d for name in order for d in PIPELINE_STAGES[name]['datasets']})
+    fingerprints = {d: dataset_fingerprint(d) for d in datasets}
+    keys, values, ran, failed, persisted = {}, {}, [], set(), 0   # failed: untargeted stages that raised
+
+    def stage_key(name):
+        spec = PIPELINE_STAGES[name]
+        digest = hashlib.sha256()
+        _code_digest(spec['fn'].__code__, digest)
+        digest.update(repr(spec['params']).encode('utf-8'))
+        digest.update(repr(sorted(stage_globals(spec['fn']).items())).encode('utf-8'))
+        for d in spec['datasets']:
+            digest.update(f"{d}={fingerprints[d]}".encode('utf-8'))
+        for up in spec['inputs']:
+            digest.update(f"{up}={keys[up]}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def cached_value(name):
+        cached = _stage_cache.get(name)
+        if cached is not None and cached[0] == keys[name]:
+            return cached
+        stored = _stored_stage(name, keys[name]) if pipeline_persist else None
+        if stored is not None:
+            _stage_cache[name] = stored
+        return stored
+
+    def execute(name):
+        spec = PIPELINE_STAGES[name]
+        t0 = time.perf_counter()
+        value = spec['fn'](*[values[up] for up in spec['inputs']])
+        return value, time.perf_counter() - t0
+
+    pending, running = list(order), {}
+    with ThreadPoolExecutor(max_workers=max(1, pipeline_workers)) as pool:
+        while pending or running:
+            for name in [n for n in pending if any(up in failed for up in PIPELINE_STAGES[n]['inputs'])]:
+                pending.remove(name)
+                failed.add(name)
+            for name in [n for n in pending if all(up in values for up in PIPELINE_STAGES[n]['inputs'])]:
+                pending.remove(name)
+                keys[name] = stage_key(name)
+                cached = None if name in force else cached_value(name)
+                if cached is not None:
+                    values[name] = cached[1]
+                else:
+                    running[pool.submit(execute, name)] = name
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    values[name], seconds = future.result()
+                except Exception as exc:
+                    if name in needed:
+                        raise
+                    failed.add(name)
+                    print(f'pipeline: {name} failed ({exc!r}); it runs again when its cell asks for it')
+                    continue
+                _stage_cache[name] = (keys[name], values[name])
+                persisted += pipeline_persist and _persist_stage(name, keys[name], values[name])
+                ran.append(f'{name} ({seconds:.1f}s)')
+    if persisted:
+        mirror_push(_stage_store())
+    print(f"pipeline: ran {', '.join(ran) if ran else 'nothing'}; {len(values) - len(ran)} stage(s) cached")
+    return values
+
+def release_pipeline(name: str = None):
+    """Forget cached stage values in memory (all stages when name is None); persisted values stay
+    valid for their key - use run_pipeline(force=[...]) to recompute."""
+    if name is None:
+        _stage_cache.clear()
+    else:
+        _stage_cache.pop(name, None)
+
+print(f'Pipeline runner: {pipeline_workers} worker thread(s)')
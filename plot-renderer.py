@@ -0,0 +1,258 @@
+#@title Plot Renderer (persistent figures, in-place artist updates; batched Plotly layout)
+# Run before the analysis cells. Each matplotlib view (bep, toe, mbp, pzml) gets one figure,
+# created on first use and shown through an image widget; Update handlers change the data of
+# the existing artists - line data, one bar collection, pooled text labels, one marker collection -
+# and re-encode the image, instead of building a new figure and replaying every artist.
+# Line series longer than the axes can show are reduced to the min and max of each
+# plot_px_per_bucket-pixel column (spikes survive); narrowing the date range brings back every point.
+# Widget callbacks go through render_later(): changes within render_debounce_s collapse into one
+# redraw, which runs on a background thread, and a redraw superseded by a newer request stops
+# at its next render_check() (view_render() checks too), so only the latest result is shown.
+# The Plotly charts (MB scatter, dice bars) add all date markers in one layout update, switch
+# to WebGL above plotly_webgl_points points and drop per-point data the hover never shows.
+import io
+import re
+import threading
+import traceback
+
+import matplotlib
+import matplotlib.dates as mdates
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.figure import Figure
+from matplotlib.patches import Patch
+from matplotlib.transforms import offset_copy
+
+try:
+    import ipywidgets as widgets
+except ImportError:   # headless (batch-report.py): views are written with view_save()
+    widgets = None
+
+plot_downsample = True      #@param {type:"boolean"}
+plot_px_per_bucket = 4      #@param {type:"integer"}  # line downsampling: one min/max pair per this many pixels
+plotly_webgl_points = 2000   #@param {type:"integer"}  # scatter points above which WebGL (scattergl) is used
+render_debounce_s = 0.3      #@param {type:"number"}   # widget changes closer than this redraw once
+
+_render_views = {}   # name -> view dict (figure, axes, widget, artist pools)
+
+def render_view(name: str, figsize=(20, 6), layout=None) -> dict:
+    """The persistent view `name`: {'fig', 'ax', 'widget', ...}; created on first use."""
+    view = _render_views.get(name)
+    if view is None or tuple(view['fig'].get_size_inches()) != tuple(figsize):
+        fig = Figure(figsize=figsize, dpi=matplotlib.rcParams['figure.dpi'], layout=layout)
+        FigureCanvasAgg(fig)
+        view = {'fig': fig, 'ax': fig.add_subplot(), 'widget': widgets.Image(format='png') if widgets is not None else None,
+                'lines': {}, 'bars': None, 'texts': {}, 'markers': None}
+        _render_views[name] = view
+    return view
+
+def downsample_minmax(y, buckets: int) -> np.ndarray:
+    """Positions of `y` to draw: the first and last point plus the min and max of each of
+    `buckets` equal-width buckets, in order (a NaN per bucket is kept so gaps stay gaps)."""
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if buckets <= 0 or n <= 2 * buckets + 2:
+        return np.arange(n)
+    bucket = np.arange(n) * buckets // n
+    nan = np.isnan(y)
+    pos = np.flatnonzero(~nan)
+    order = pos[np.lexsort((y[pos], bucket[pos]))]   # by bucket, then value
+    edge = bucket[order][1:] != bucket[order][:-1]
+    gaps = np.flatnonzero(nan)
+    gaps = gaps[np.r_[True, bucket[gaps][1:] != bucket[gaps][:-1]]] if len(gaps) else gaps
+    return np.unique(np.concatenate([[0, n - 1], order[np.r_[True, edge]], order[np.r_[edge, True]], gaps]))
+
+def view_lines(view: dict, lines, legend: bool = True):
+    """Show exactly `lines` = [(label, x, y, style)], reusing each label's Line2D; rescale.
+
+    With plot_downsample, each line is cut to a min/max pair per plot_px_per_bucket pixels of
+    axes width (downsample_minmax); lines that fit are drawn unchanged.
+    """
+    ax, pool, shown = view['ax'], view['lines'], []
+    buckets = int(ax.get_window_extent().width // max(1, plot_px_per_bucket)) if plot_downsample else 0
+    for label, x, y, style in lines:
+        if buckets and len(y) > 2 * buckets + 2:
+            keep = downsample_minmax(y, buckets)
+            x, y = np.asarray(x)[keep], np.asarray(y)[keep]
+        line = pool.get(label)
+        if line is None:
+            line, = ax.plot(x, y, label=label, **style)
+            pool[label] = line
+        else:
+            line.set_data(x, y)
+            line.set_visible(True)
+        shown.append(label)
+    for label, line in pool.items():
+        if label not in shown:
+            line.set_visible(False)
+    ax.relim(visible_only=True)
+    ax.autoscale_view()
+    if legend and shown:
+        ax.legend([pool[label] for label in shown], shown)
+    elif ax.get_legend() is not None:
+        ax.get_legend().remove()
+
+def view_stacked_bars(view: dict, columns, heights: np.ndarray, colors: dict, width: float = 0.8) -> dict:
+    """Stacked bars (heights[i, j] of column j at x = i) as one PolyCollection; returns legend handles."""
+    ax = view['ax']
+    n_x, n_cols = heights.shape
+    tops = np.cumsum(heights, axis=1)
+    x0 = np.repeat(np.arange(n_x) - width / 2, n_cols)
+    x1 = x0 + width
+    y0, y1 = (tops - heights).ravel(), tops.ravel()
+    verts = np.stack([np.column_stack([x0, y0]), np.column_stack([x0, y1]),
+                      np.column_stack([x1, y1]), np.column_stack([x1, y0])], axis=1)
+    if view['bars'] is None:
+        view['bars'] = ax.add_collection(PolyCollection([], edgecolors='none'), autolim=False)
+    view['bars'].set_verts(verts)
+    view['bars'].set_facecolor([colors[col] for _ in range(n_x) for col in columns])
+    if n_x:
+        ax.set_xlim(-0.5, n_x - 0.5)
+    return {col: Patch(facecolor=colors[col], edgecolor='none') for col in columns}
+
+def view_texts(view: dict, pool_name: str, xs, ys, texts, colors=None, transform=None, **style):
+    """Place `texts` at (xs, ys) using a pool of Text artists (extra ones are hidden)."""
+    ax = view['ax']
+    pool = view['texts'].setdefault(pool_name, [])
+    while len(pool) < len(texts):
+        artist = ax.text(0, 0, '', transform=transform or ax.transData, **style)
+        artist.set_in_layout(False)   # labels sit inside the axes; keeps tight layout cheap
+        pool.append(artist)
+    colors = colors if colors is not None else [None] * len(texts)
+    for artist, x, y, s, c in zip(pool, xs, ys, texts, colors):
+        artist.set_position((x, y))
+        artist.set_text(s)
+        if c is not None:
+            artist.set_color(c)
+        artist.set_visible(True)
+    for artist in pool[len(texts):]:
+        artist.set_visible(False)
+
+def view_markers(view: dict, dates, labels, y: float = 1.0, offset=(0, 0), line_style=None, **text_style):
+    """Vertical date markers as one LineCollection plus pooled labels at axes-fraction y."""
+    ax = view['ax']
+    xs = mdates.date2num(pd.DatetimeIndex(dates).to_numpy())
+    if view['markers'] is None:
+        view['markers'] = ax.add_collection(
+            LineCollection([], transform=ax.get_xaxis_transform(), **(line_style or {})), autolim=False)
+    view['markers'].set_segments([[(x, 0), (x, 1)] for x in xs])
+    transform = offset_copy(ax.get_xaxis_transform(), fig=view['fig'], x=offset[0], y=offset[1], units='points')
+    view_texts(view, 'markers', xs, [y] * len(xs), [str(s) for s in labels], transform=transform, **text_style)
+
+def view_render(view: dict):
+    """Re-encode the figure into its image widget."""
+    render_check()
+    buf = io.BytesIO()
+    view['fig'].savefig(buf, format='png', pil_kwargs={'compress_level': 1})   # fast zlib; size barely matters here
+    view['widget'].value = buf.getvalue()
+
+def view_save(view: dict, path: str):
+    """Write the figure to an image file (format from the extension)."""
+    view['fig'].savefig(path)
+
+# ----------------------------
+# Background render scheduling
+# ----------------------------
+class RenderSuperseded(Exception):
+    """Raised by render_check() inside a scheduled job that a newer request replaced."""
+
+_render_jobs = {}              # name -> {'generation', 'timer', 'lock', 'settled'}
+_render_jobs_lock = threading.Lock()
+_render_local = threading.local()   # (name, generation) of the job running on this thread
+
+def render_later(name: str, job, delay: float = None):
+    """Run job() on a background thread once requests for `name` pause for `delay` seconds.
+
+    Every call supersedes the previous one: a pending job is dropped, a running one stops at
+    its next render_check(). Jobs of one name never run concurrently.
+    """
+    with _render_jobs_lock:
+        state = _render_jobs.setdefault(name, {'generation': 0, 'timer': None,
+                                               'lock': threading.Lock(), 'settled': threading.Event()})
+        state['generation'] += 1
+        state['settled'].clear()
+        if state['timer'] is not None:
+            state['timer'].cancel()
+        state['timer'] = threading.Timer(render_debounce_s if delay is None else delay,
+                                         _render_run, (name, state['generation'], job))
+        state['timer'].daemon = True
+        state['timer'].start()
+
+def _render_run(name: str, generation: int, job):
+    state = _render_jobs[name]
+    with state['lock']:
+        if state['generation'] != generation:
+            return
+        _render_local.job = (name, generation)
+        try:
+            job()
+        except RenderSuperseded:
+            pass
+        except Exception:
+            traceback.print_exc()
+        finally:
+            _render_local.job = None
+            if state['generation'] == generation:
+                state['settled'].set()
+
+def render_check():
+    """Inside a render_later() job: raise RenderSuperseded if a newer request exists (no-op elsewhere)."""
+    job = getattr(_render_local, 'job', None)
+    if job is not None and _render_jobs[job[0]]['generation'] != job[1]:
+        raise RenderSuperseded(job[0])
+
+def render_wait(name: str, timeout: float = None) -> bool:
+    """Block until the latest requested render of `name` finished (True) or `timeout` passed."""
+    state = _render_jobs.get(name)
+    return state is None or state['settled'].wait(timeout)
+
+# ----------------------------
+# Plotly
+# ----------------------------
+def plotly_render_mode(n_points: int) -> str:
+    """render_mode for px.scatter: WebGL above plotly_webgl_points points, SVG below."""
+    return 'webgl' if n_points > plotly_webgl_points else 'svg'
+
+def plotly_date_markers(fig, dates, labels, y: float = 1.02, shape=None, **annotation):
+    """Dotted vertical lines + rotated labels at `dates`, added in a single layout update.
+
+    add_vline / add_annotation re-validate the whole layout per call; building the shape and
+    annotation dicts first keeps the cost flat however many markers there are.
+    """
+    dates = [pd.Timestamp(d).strftime('%Y-%m-%d') for d in dates]
+    shapes = [dict(type='line', xref='x', yref='paper', x0=d, x1=d, y0=0, y1=1,
+                   line=dict(dash='dot', width=1), **(shape or {})) for d in dates]
+    notes = [dict(x=d, y=y, xref='x', yref='paper', text=str(label), showarrow=False, **annotation)
+             for d, label in zip(dates, labels)]
+    fig.update_layout(shapes=[*fig.layout.shapes, *shapes], annotations=[*fig.layout.annotations, *notes])
+    return fig
+
+def plotly_prune(fig):
+    """Shrink the figure JSON: keep only the customdata columns the hovertemplate shows, drop
+    unused hovertext, and send midnight datetimes as 'YYYY-MM-DD' strings."""
+    with fig.batch_update():
+        for trace in fig.data:
+            template = getattr(trace, 'hovertemplate', None) or ''
+            custom = getattr(trace, 'customdata', None)
+            if custom is not None:
+                used = sorted({int(i) for i in re.findall(r'customdata\[(\d+)\]', template)})
+                if not used:
+                    trace.customdata = None
+                elif np.ndim(custom) == 2 and len(used) < np.shape(custom)[1]:
+                    trace.customdata = np.asarray(custom)[:, used]
+                    trace.hovertemplate = re.sub(r'customdata\[(\d+)\]',
+                                                 lambda m: f'customdata[{used.index(int(m.group(1)))}]', template)
+            if getattr(trace, 'hovertext', None) is not None and 'hovertext' not in template:
+                trace.hovertext = None
+            for axis in ('x', 'y'):
+                values = getattr(trace, axis, None)
+                if values is None or np.asarray(values).dtype.kind != 'M':
+                    continue
+                days = np.asarray(values).astype('datetime64[D]')
+                if (days == np.asarray(values)).all():
+                    setattr(trace, axis, np.datetime_as_string(days))
+    return fig
+
+print('Plot renderer ready')
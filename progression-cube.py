@@ -0,0 +1,99 @@
+#@title Progression Cube (deduplicated players per event × config × position)
+# Run after aggregation-backend.py. At ingest the MB, dice and puzzle progression rows are
+# reduced to one row per (player, event) - per (player, event, config) for puzzle, where a player
+# can play several configs of one event - keeping the furthest position, and counted into a
+# small (source, event_start, config, position) -> players table (progression_cube.parquet).
+# The distribution views then sum that table instead of distinct-counting player ids.
+import numpy as np
+import pandas as pd
+
+progression_cube_enabled = True   #@param {type:"boolean"}
+
+PROGRESSION_SOURCES = {
+    # source: dataset, event / config / position columns, columns that must be present,
+    # cube columns a player is counted once per
+    'mb':     {'dataset': 'mb_progression',     'event': 'mb_event_start',         'config': 'config_id',
+               'position': 'last_position',    'required': [], 'once_per': ['event_start']},
+    'dice':   {'dataset': 'dice_progression',   'event': 'dice_event_start',       'config': 'config_name',
+               'position': 'last_position',    'required': [], 'once_per': ['event_start']},
+    'puzzle': {'dataset': 'puzzle_progression', 'event': 'puzzle_event_starts_at', 'config': 'puzzle_config_display_name',
+               'position': 'levels_completed', 'required': ['puzzle_config_display_name'],
+               'once_per': ['event_start', 'config']},
+}
+
+def player_codes(*ids: pd.Series) -> list:
+    """Dense int32 codes for player ids, shared across the given series (one code space)."""
+    codes, _ = pd.factorize(pd.concat([s.astype(str) if isinstance(s.dtype, pd.CategoricalDtype) else s for s in ids],
+                                      ignore_index=True))
+    bounds = np.cumsum([0, *[len(s) for s in ids]])
+    return [codes[lo:hi].astype(np.int32) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+def _cube_rows(source: str, df: pd.DataFrame, codes: np.ndarray) -> pd.DataFrame:
+    spec = PROGRESSION_SOURCES[source]
+    rows = pd.DataFrame({
+        'player': codes,
+        'event_start': df[spec['event']].to_numpy(),
+        'config': df[spec['config']].to_numpy(),
+        'position': df[spec['position']].to_numpy(),
+    })
+    keep = (codes >= 0) & rows['event_start'].notna() & rows['position'].notna()
+    for col in spec['required']:
+        keep &= df[col].notna().to_numpy()
+    rows = rows[keep]
+    # one row per (player, *once_per): the furthest position reached
+    rows = rows.sort_values('position', ascending=False, kind='stable').drop_duplicates(['player', *spec['once_per']])
+    cube = rows.groupby(['event_start', 'config', 'position'], dropna=False, observed=True).size().rename('players').reset_index()
+    return cube.assign(source=source)
+
+def build_progression_cube(frames: dict) -> pd.DataFrame:
+    """Cube rows (source, event_start, config, position, players) from {source: progression frame}."""
+    sources = [s for s in PROGRESSION_SOURCES if s in frames]
+    codes = player_codes(*[frames[s]['player_id'] for s in sources])
+    cube = pd.concat([_cube_rows(s, frames[s], c) for s, c in zip(sources, codes)], ignore_index=True)
+    cube['config'] = cube['config'].astype(str).where(cube['config'].notna())
+    return apply_schema(cube, 'progression_cube')
+
+def progression_cube(source: str) -> pd.DataFrame:
+    """Cube rows of one source (event_start, config, position, players)."""
+    cube = load_dataset('progression_cube')
+    return cube.loc[cube['source'] == source, ['event_start', 'config', 'position', 'players']]
+
+def progression_distribution(source: str, configs=None) -> pd.DataFrame:
+    """Players per (event, position) for `source`, optionally only for the given configs.
+
+    Columns use the source dataset's names: <event>, <position>, unique_players. Sums the
+    progression cube; without a stored cube it falls back to distinct counts on the raw rows.
+    """
+    spec = PROGRESSION_SOURCES[source]
+    if not (progression_cube_enabled and dataset_available('progression_cube')):
+        where = None if configs is None else {spec['config']: list(configs)}
+        return agg_unique_players(spec['dataset'], [spec['event'], spec['position']], where=where,
+                                  required=spec['required'])
+    cube = progression_cube(source)
+    if configs is not None:
+        cube = cube[cube['config'].isin(list(configs))]
+    dist = cube.groupby(['event_start', 'position'], observed=True)['players'].sum().reset_index()
+    return dist.rename(columns={'event_start': spec['event'], 'position': spec['position'], 'players': 'unique_players'})
+
+def progression_array(source: str):
+    """Dense players[config, event, position] array for `source` plus its three axis labels.
+
+    Built once per cell run; filtering by config is then a sum over axis 0 of a small array,
+    whatever the number of ingested players.
+    """
+    spec = PROGRESSION_SOURCES[source]
+    if progression_cube_enabled and dataset_available('progression_cube'):
+        cube = progression_cube(source)
+    else:
+        cube = agg_unique_players(spec['dataset'], [spec['config'], spec['event'], spec['position']],
+                                  required=spec['required'])
+        cube = cube.set_axis(['config', 'event_start', 'position', 'players'], axis=1)
+    cube = cube.dropna(subset=['config'])
+    config_codes, configs = pd.factorize(cube['config'].astype(str), sort=True)
+    event_codes, events = pd.factorize(cube['event_start'], sort=True)
+    position_codes, positions = pd.factorize(cube['position'].astype('int64'), sort=True)
+    players = np.zeros((len(configs), len(events), len(positions)), dtype=np.int64)
+    np.add.at(players, (config_codes, event_codes, position_codes), cube['players'].to_numpy(dtype=np.int64))
+    return players, pd.Index(configs), pd.DatetimeIndex(events), pd.Index(positions)
+
+print('Progression cube ' + ('enabled' if progression_cube_enabled else 'disabled'))
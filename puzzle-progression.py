@@ -13,35 +13,25 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import ipywidgets as widgets
 from IPython.display import display, clear_output
-import matplotlib.cm as cm
 import matplotlib.ticker as mticker
 
 # ----------------------------
-# 1) Minimal preprocessing
+# 1) Filter state: unique players per (config, event, level)
 # ----------------------------
-pzml_base = puzzle_progression[
-    ['player_id','levels_completed','puzzle_config_display_name','puzzle_event_starts_at']
-].copy()
+# Built once from the progression cube (progression-cube.py): one row per player, event and
+# config (a player in two configs of an event counts in both, as the per-config nunique did);
+# rows without a config, event start or level are left out. Every widget change below only
+# sums this array over the selected configs, so redraws don't depend on the player count.
+@pipeline_stage('pzml_counts', datasets=['progression_cube', 'puzzle_progression'])   # pipeline-runner.py
+def pzml_counts_stage():
+    return progression_array('puzzle')
 
-pzml_base['puzzle_event_starts_at'] = pd.to_datetime(
-    pzml_base['puzzle_event_starts_at'], errors='coerce'
-).dt.normalize()
-pzml_base['levels_completed'] = pd.to_numeric(
-    pzml_base['levels_completed'], errors='coerce'
-)
-pzml_base = pzml_base.dropna(
-    subset=['player_id','levels_completed','puzzle_config_display_name','puzzle_event_starts_at']
-)
+pzml_counts, pzml_cfg_axis, pzml_event_axis, pzml_level_axis = run_pipeline(['pzml_counts'])['pzml_counts']
 
 # ----------------------------
 # 2) Smart config groups (by MAX levels)
 # ----------------------------
-pzml_cfg_max = (
-    pzml_base.groupby('puzzle_config_display_name')['levels_completed']
-             .max()
-             .rename('max_levels')
-             .reset_index()
-)
+pzml_cfg_max = puzzle_max_levels(pzml_counts, pzml_cfg_axis, pzml_level_axis)   # chart-builders.py
 
 pzml_available_levels = sorted(pzml_cfg_max['max_levels'].dropna().astype(int).unique().tolist())
 
@@ -68,132 +58,51 @@ pzml_update_btn = widgets.Button(
     layout=widgets.Layout(width='100px')
 )
 
-pzml_out = widgets.Output()
+# One persistent figure, updated in place on every change (plot-renderer.py)
+pzml_view = render_view('pzml', figsize=(14, 5), layout='tight')
 
 # ----------------------------
 # 4) Data filtering
 # ----------------------------
-def pzml_get_filtered_df(level_choice, configs_selected):
-    """Return filtered dataframe by max level & specific config selections."""
+def pzml_selected_configs(level_choice, configs_selected):
+    """Configs allowed by the max-level bucket & specific config selections (None = all configs)."""
+    configs = None
     # Filter by max-level bucket
-    if level_choice == 'All':
-        df = pzml_base.copy()
-    else:
-        allowed_configs = set(
+    if level_choice != 'All':
+        configs = set(
             pzml_cfg_max.loc[pzml_cfg_max['max_levels'] == int(level_choice), 'puzzle_config_display_name']
         )
-        df = pzml_base[pzml_base['puzzle_config_display_name'].isin(allowed_configs)]
 
     # Then filter by specific configs (if not "All")
     if configs_selected and 'All' not in configs_selected:
-        df = df[df['puzzle_config_display_name'].isin(configs_selected)]
+        configs = set(configs_selected) if configs is None else configs & set(configs_selected)
 
-    return df
+    return configs
 
 # ----------------------------
 # 5) Draw function
 # ----------------------------
 def pzml_draw(level_choice, configs_selected):
-    pzml_df = pzml_get_filtered_df(level_choice, configs_selected)
-    if pzml_df.empty:
-        print("No data for the selected filters.")
-        return
-
-    # aggregate unique players per (event, level)
-    pzml_agg = (
-        pzml_df.groupby(['puzzle_event_starts_at','levels_completed'])['player_id']
-               .nunique()
-               .reset_index(name='unique_players')
-    )
-    if pzml_agg.empty:
-        print("No data after aggregation.")
-        return
-
-    # totals per event + percent
-    pzml_tot = (
-        pzml_agg.groupby('puzzle_event_starts_at')['unique_players']
-                .sum().reset_index(name='total_unique_players')
-    )
-    pzml_agg = pzml_agg.merge(pzml_tot, on='puzzle_event_starts_at', how='left')
-    pzml_agg['pct_of_total'] = (pzml_agg['unique_players'] / pzml_agg['total_unique_players']) * 100
-
-    # pivot to wide
-    pzml_pivot = pzml_agg.pivot_table(
-        index='puzzle_event_starts_at',
-        columns='levels_completed',
-        values='pct_of_total',
-        fill_value=0.0
-    ).sort_index()
-
-    if pzml_pivot.empty:
-        print("No data to display after pivot.")
-        return
-
-    # ---- Color scale (sensitive slice of the colormap) ----
-    level_cols = sorted(pzml_pivot.columns.tolist())
-    n_levels = max(1, len(level_cols))
-    cmap = cm.get_cmap(pzml_colormap_name)
-    # Sample within a central range for better sensitivity
-    samples = np.linspace(pzml_cmap_span[0], pzml_cmap_span[1], n_levels)
-    level_colors = {lvl: cmap(s) for lvl, s in zip(level_cols, samples)}
-
-    # ---- Matplotlib stacked 100% bar ----
-    fig, ax = plt.subplots(figsize=(14, 5))
-    x = np.arange(len(pzml_pivot.index))
-    bottoms = np.zeros(len(pzml_pivot.index))
-
-    # Plot each level with its colormap-derived color
-    for lvl in level_cols:
-        heights = pzml_pivot[lvl].values
-        ax.bar(x, heights, bottom=bottoms, label=str(lvl), color=level_colors[lvl], edgecolor='none')
-        # Add labels for sufficiently large segments
-        for i, h in enumerate(heights):
-            if h >= pzml_label_min_pct:
-                # choose text color for contrast based on segment size
-                txt_color = 'white' if h >= pzml_label_big_cut else 'black'
-                ax.text(
-                    x[i],
-                    bottoms[i] + h/2.0,
-                    pzml_label_fmt.format(h),
-                    ha='center', va='center',
-                    fontsize=pzml_label_fontsize,
-                    color=txt_color
-                )
-        bottoms += heights
-
-    # X-axis labels
-    ax.set_xticks(x)
-    ax.set_xticklabels(
-        [pd.to_datetime(d).strftime('%Y-%m-%d') for d in pzml_pivot.index],
-        rotation=45, ha='right'
-    )
-
-    # Y-axis, title, legend, grid
-    ax.set_ylim(0, 100)
-    ax.set_ylabel('% of players')
-    ax.set_xlabel('Event start')
+    pzml_configs = pzml_selected_configs(level_choice, configs_selected)
+    if pzml_configs is not None and not pzml_configs:
+        chart_puzzle_clear(pzml_view, "No data for the selected filters.")
+        return view_render(pzml_view)
 
+    # unique players per (event, level) over the selected configs: a sum over the config axis
+    pzml_mask = np.ones(len(pzml_cfg_axis), bool) if pzml_configs is None else pzml_cfg_axis.isin(pzml_configs)
     cfg_summary = (
         "All configs" if not configs_selected or 'All' in configs_selected
         else f"{len(configs_selected)} selected config(s)"
     )
     suffix = f"MAX levels = {level_choice}" if level_choice != 'All' else "All levels"
-    ax.set_title(f'Players % by Levels Completed per PUZZLE Event — {suffix}, {cfg_summary}')
-
-    # Cleaner legend with level order (lowest at bottom)
-    handles, labels = ax.get_legend_handles_labels()
-    order = np.argsort([int(l) for l in labels])
-    ax.legend(
-        [handles[i] for i in order],
-        [labels[i] for i in order],
-        title='Levels completed',
-        bbox_to_anchor=(1.02, 1), loc='upper left',
-        frameon=False
+    # 100% stacked bars, labels and legend drawn in place (chart-builders.py)
+    chart_puzzle_levels(
+        pzml_view, pzml_counts[pzml_mask].sum(axis=0), pzml_event_axis, pzml_level_axis,
+        f'Players % by Levels Completed per PUZZLE Event — {suffix}, {cfg_summary}',
+        colormap=pzml_colormap_name, cmap_span=pzml_cmap_span, label_min_pct=pzml_label_min_pct,
+        label_fmt=pzml_label_fmt, label_fontsize=pzml_label_fontsize, label_big_cut=pzml_label_big_cut,
     )
-
-    ax.grid(axis='y', linestyle=':', linewidth=0.7, alpha=0.7)
-    plt.tight_layout()
-    plt.show()
+    view_render(pzml_view)
 
 # ----------------------------
 # 6) UI logic: update config list dynamically
@@ -215,20 +124,23 @@ def pzml_update_config_list(change=None):
 # 7) Update function (triggered by button or dropdowns)
 # ----------------------------
 def pzml_update(_=None):
-    with pzml_out:
-        clear_output(wait=True)
-        pzml_draw(pzml_levels_dropdown.value, pzml_config_dropdown.value)
+    pzml_draw(pzml_levels_dropdown.value, pzml_config_dropdown.value)
+
+def pzml_schedule(_=None):
+    # background redraw with the widget values current when it runs (plot-renderer.py): the
+    # level change + config-list reset, or a burst of config toggles, draw once
+    render_later('pzml', pzml_update)
 
 # Link interactions
-pzml_update_btn.on_click(pzml_update)
-pzml_levels_dropdown.observe(lambda change: (pzml_update_config_list(), pzml_update()), names='value')
-pzml_config_dropdown.observe(lambda change: pzml_update(), names='value')
+pzml_update_btn.on_click(pzml_schedule)
+pzml_levels_dropdown.observe(lambda change: (pzml_update_config_list(), pzml_schedule()), names='value')
+pzml_config_dropdown.observe(lambda change: pzml_schedule(), names='value')
 
 # ----------------------------
 # 8) Display controls & first draw
 # ----------------------------
 display(widgets.HBox([pzml_levels_dropdown, pzml_config_dropdown, pzml_update_btn]))
-display(pzml_out)
+display(pzml_view['widget'])
 
 pzml_update_config_list()
 pzml_update()
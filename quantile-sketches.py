@@ -0,0 +1,130 @@
+#@title Energy Quantile Sketches (mergeable per-day sketches for weekly / monthly percentiles)
+# Run after aggregation-backend.py. One sketch per (promo_date, is_payer, metric) is kept in the
+# energy_sketches dataset; weekly, monthly and "All"-segment percentiles merge the daily
+# sketches instead of re-scanning the per-player rows.
+#
+# The sketch is DDSketch-style: values fall into logarithmic buckets of relative width
+# 2 * sketch_relative_error, so any quantile read from it is within that relative error of the
+# true value, and merging two sketches is adding their bucket counts (per day, per batch, ...).
+import numpy as np
+import pandas as pd
+
+sketch_enabled         = True   #@param {type:"boolean"}
+sketch_relative_error  = 0.01   #@param {type:"number"}  # 0.01 = values within ±1%
+sketch_chunk_days      = 14     #@param {type:"integer"} # player_balance days read per build step
+sketch_metrics = ['energy_balance_bop', 'energy_balance_eop', 'total_energy_out']
+
+_SKETCH_KEY_OFFSET = 1 << 20   # keeps bucket keys of values in (0, 1) positive; 0 is the zero bucket
+
+def _sketch_gamma(alpha: float) -> float:
+    return (1 + alpha) / (1 - alpha)
+
+def sketch_buckets(values: np.ndarray, alpha: float = None) -> np.ndarray:
+    """Signed bucket key per value; keys sort in the same order as the values."""
+    log_gamma = np.log(_sketch_gamma(sketch_relative_error if alpha is None else alpha))
+    values = np.asarray(values, dtype='float64')
+    magnitude = np.abs(values)
+    with np.errstate(divide='ignore'):
+        k = np.ceil(np.log(np.where(magnitude > 0, magnitude, 1.0)) / log_gamma) + _SKETCH_KEY_OFFSET
+    return (np.sign(values) * np.maximum(k, 1)).astype(np.int64)
+
+def sketch_values(buckets: np.ndarray, alpha: float) -> np.ndarray:
+    """Representative value of each bucket (relative error <= alpha for anything in it)."""
+    gamma = _sketch_gamma(alpha)
+    buckets = np.asarray(buckets, dtype=np.int64)
+    k = np.abs(buckets) - _SKETCH_KEY_OFFSET
+    return np.sign(buckets) * 2 * np.power(gamma, k.astype('float64')) / (gamma + 1)
+
+def build_sketches(df: pd.DataFrame, metrics=None, alpha: float = None) -> pd.DataFrame:
+    """Sketch rows (promo_date, is_payer, metric, bucket, count) of per-player rows."""
+    alpha = sketch_relative_error if alpha is None else alpha
+    parts = []
+    for metric in metrics or sketch_metrics:
+        if metric not in df.columns:
+            continue
+        rows = df[['promo_date', 'is_payer']].assign(bucket=0)
+        values = df[metric].to_numpy(dtype='float64', na_value=np.nan)
+        valid = ~np.isnan(values) & df['promo_date'].notna().to_numpy() & df['is_payer'].notna().to_numpy()
+        rows = rows[valid]
+        rows['bucket'] = sketch_buckets(values[valid], alpha)
+        counts = rows.groupby(['promo_date', 'is_payer', 'bucket']).size().rename('count').reset_index()
+        parts.append(counts.assign(metric=metric))
+    sketches = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(
+        columns=['promo_date', 'is_payer', 'bucket', 'count', 'metric'])
+    sketches['relative_error'] = alpha
+    return apply_schema(sketches, 'energy_sketches')
+
+def _stored_sketch_error():
+    """relative_error of the stored sketches (None when there are none)."""
+    dates = stored_partitions('energy_sketches')
+    if not dates:
+        return None
+    sample = read_dataset('energy_sketches', columns=['relative_error'],
+                          filters=[('promo_date', '==', dates[-1])], hot_cache=False)
+    return float(sample['relative_error'].iloc[0]) if len(sample) else None
+
+def sync_energy_sketches(refresh_from=None) -> int:
+    """Bring energy_sketches in line with the stored player_balance days; returns #days built.
+
+    Days missing a sketch are built, days no longer in player_balance are dropped, and days
+    on/after refresh_from are rebuilt (refresh_from=None rebuilds every day). player_balance is
+    read sketch_chunk_days at a time, so memory stays bounded whatever the window length.
+    """
+    mirror_pull(dataset_path('energy_sketches'))
+    pb_days = stored_partitions('player_balance')
+    sketch_days = stored_partitions('energy_sketches')
+    full = refresh_from is None or _stored_sketch_error() != sketch_relative_error
+    build = [d for d in pb_days if full or d >= refresh_from or d not in sketch_days]
+    for i in range(0, len(build), sketch_chunk_days):
+        chunk = build[i:i + sketch_chunk_days]
+        rows = read_dataset('player_balance', columns=['promo_date', 'is_payer', *sketch_metrics],
+                            filters=[('promo_date', 'in', chunk)], hot_cache=False)
+        write_dataset(build_sketches(rows), 'energy_sketches')   # into the staging area
+    if not full:
+        drop_partitions('energy_sketches', sorted(set(sketch_days) - set(pb_days)))
+    commit_staging('energy_sketches', partitions_only=not full)
+    release_dataset('energy_sketches')
+    return len(build)
+
+def sketch_quantiles(metrics, qs, freq: str = 'D', start=None, end=None) -> dict:
+    """{metric: frame} of percentiles per period from the merged daily sketches.
+
+    freq: 'D', 'W' (weeks starting Monday) or 'M'. Frames match agg_daily_quantiles (index
+    (is_payer with 'All', promo_date = period start), columns q) and carry the guaranteed
+    relative error in frame.attrs['relative_error'].
+    """
+    sketches = load_dataset('energy_sketches', ['promo_date', 'is_payer', 'metric', 'bucket', 'count', 'relative_error'],
+                            start, end)
+    alpha = float(sketches['relative_error'].iloc[0]) if len(sketches) else sketch_relative_error
+    period = sketches['promo_date'] if freq == 'D' else \
+        sketches['promo_date'].dt.to_period('W-SUN' if freq == 'W' else freq).dt.start_time.astype('datetime64[ms]')
+    q_index = pd.Index(list(qs), name='q')
+    out = {}
+    for metric in metrics:
+        rows = sketches[sketches['metric'] == metric].assign(promo_date=period)
+        by_segment = rows.groupby(['is_payer', 'promo_date', 'bucket'], observed=True)['count'].sum()
+        overall = rows.groupby(['promo_date', 'bucket'], observed=True)['count'].sum()
+        overall = pd.concat({'All': overall}, names=['is_payer'])
+        merged = pd.concat([overall, by_segment]).reset_index()
+        # merging = summing bucket counts; then one pass for every (segment, period) group
+        groups = merged.groupby(['is_payer', 'promo_date'], sort=False).ngroup().to_numpy()
+        order = np.lexsort((merged['bucket'].to_numpy(), groups))
+        groups, counts = groups[order], merged['count'].to_numpy()[order]
+        buckets = merged['bucket'].to_numpy()[order]
+        n_groups = groups.max() + 1 if len(groups) else 0
+        totals = np.bincount(groups, weights=counts, minlength=n_groups)
+        cum = np.cumsum(counts)
+        starts = np.searchsorted(groups, np.arange(n_groups))
+        before = cum[starts] - counts[starts]   # count of all earlier groups
+        values = np.empty((n_groups, len(qs)))
+        for j, q in enumerate(qs):
+            # first bucket whose cumulative count exceeds rank q * (n - 1)
+            idx = np.searchsorted(cum, before + np.floor(q * (totals - 1)), side='right')
+            values[:, j] = sketch_values(buckets[idx], alpha)
+        keys = merged[['is_payer', 'promo_date']].iloc[order].drop_duplicates()
+        frame = pd.DataFrame(values, index=pd.MultiIndex.from_frame(keys), columns=q_index).sort_index()
+        frame.attrs['relative_error'] = alpha
+        out[metric] = frame
+    return out
+
+print(f'Energy sketches: relative error {sketch_relative_error:.1%}' + ('' if sketch_enabled else ' (disabled)'))
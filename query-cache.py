@@ -0,0 +1,108 @@
+#@title Query Result Cache (local parquet in front of the Snowflake connection)
+# Run after snowflake-connector.py. read-data-from-snowflake.py routes its queries through
+# cached_query(), so re-running the ingest with the same SQL on the same day is served
+# from local disk instead of re-billing warehouse time and re-transferring the result.
+#
+# Works with any DB-API style connection (Snowflake, or a sqlite3/DuckDB stand-in):
+# only cursor(), execute(), description, fetchall() and close() are required.
+import hashlib
+import os
+import re
+import threading
+import time
+from datetime import date
+
+import pandas as pd
+
+qc_cache_dir = '/content/query_cache'   #@param {type:"string"}
+qc_ttl_hours = 12                       #@param {type:"number"}
+qc_max_gb    = 20                       #@param {type:"number"}
+
+_qc_lock = threading.Lock()
+
+_QC_QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")   # string literals, quoted identifiers
+
+def qc_normalise_sql(sql: str) -> str:
+    """Drop full-line comments and the trailing ';'; collapse whitespace and lowercase keywords
+    and names outside quotes ('...' literals and "..." identifiers are left untouched)."""
+    sql = re.sub(r'^\s*--.*$', '', sql, flags=re.M)
+    parts = _QC_QUOTED.split(sql)
+    sql = ''.join(part if i % 2 else re.sub(r'\s+', ' ', part.lower()) for i, part in enumerate(parts))
+    return sql.strip().rstrip(';').strip()
+
+def qc_key(sql: str, window=None) -> str:
+    """Cache key: hash of the normalised SQL plus the date window it resolves to.
+
+    The extraction queries are written relative to current_date, so by default the
+    window is today's date and yesterday's results never answer today's queries.
+    """
+    window = date.today() if window is None else window
+    payload = f"{qc_normalise_sql(sql)}\n{window}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def qc_fetch(conn, sql: str) -> pd.DataFrame:
+    cur = conn.cursor()
+    try:
+        cur.execute(sql)
+        if hasattr(cur, 'fetch_pandas_all'):
+            return cur.fetch_pandas_all()
+        columns = [d[0] for d in cur.description]
+        return pd.DataFrame.from_records(cur.fetchall(), columns=columns)
+    finally:
+        cur.close()
+
+def qc_evict(max_gb=None):
+    """Remove expired entries, then least-recently used ones until the cache fits in max_gb."""
+    limit = (qc_max_gb if max_gb is None else max_gb) * 1024**3
+    if not os.path.isdir(qc_cache_dir):
+        return
+    with _qc_lock:
+        now = time.time()
+        entries = []
+        for entry in os.scandir(qc_cache_dir):
+            if not entry.name.endswith('.parquet'):
+                continue
+            st = entry.stat()
+            if now - st.st_mtime >= qc_ttl_hours * 3600:
+                os.remove(entry.path)
+                continue
+            entries.append((st.st_atime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= limit:
+                break
+            os.remove(path)
+            total -= size
+
+def cached_query(conn, sql: str, window=None, refresh: bool = False, ttl_hours=None, name=None) -> pd.DataFrame:
+    """Run `sql` on `conn`, or serve it from the local cache while the entry is younger than the TTL.
+
+    refresh=True re-runs the query and replaces the cached entry.
+    """
+    ttl = (qc_ttl_hours if ttl_hours is None else ttl_hours) * 3600
+    path = os.path.join(qc_cache_dir, qc_key(sql, window) + '.parquet')
+    label = name or 'query'
+
+    if not refresh and os.path.exists(path):
+        written = os.path.getmtime(path)
+        if time.time() - written < ttl:
+            os.utime(path, (time.time(), written))   # atime marks last use for LRU eviction
+            print(f"{label}: served from query cache")
+            return pd.read_parquet(path)
+
+    df = qc_fetch(conn, sql)
+    os.makedirs(qc_cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    qc_evict()
+    return df
+
+def qc_clear():
+    """Drop every cached result."""
+    with _qc_lock:
+        if os.path.isdir(qc_cache_dir):
+            for entry in os.scandir(qc_cache_dir):
+                os.remove(entry.path)
+
+print(f'Query cache ready at {qc_cache_dir} (ttl {qc_ttl_hours}h, max {qc_max_gb} GB)')
@@ -3,6 +3,7 @@ import pandas as pd
 from google.auth import default
 from google.colab import auth
 import numpy as np
+import os
 from google.colab import drive
 import ipywidgets as widgets
 from IPython.display import display
@@ -13,35 +14,40 @@ auth.authenticate_user()
 creds, _ = default()
 gc = gspread.authorize(creds)
 
-# add spreadsheet key
-spreadsheet = gc.open_by_key('')
-worksheet = spreadsheet.worksheet('monetization_plan')
-monetization_plan = pd.DataFrame(worksheet.get())
-monetization_plan.columns = monetization_plan.iloc[0]
-monetization_plan = monetization_plan.drop(0)
-monetization_plan.columns = monetization_plan.columns.str.strip().str.lower().str.replace(' ', '_')
-monetization_plan = monetization_plan[['date', 'special_holiday', 'campaign', 'new_features', 'cycle', 'main_story', 'album', 'puzzle_/_th', 'trail_/_dice', 'theme_path']]
-monetization_plan.rename(columns={'date': 'promo_date'}, inplace=True)
-monetization_plan['promo_date'] = pd.to_datetime(monetization_plan['promo_date']).dt.date
-
 drive.mount('/content/drive')
 
 data_path = '/content/drive/MyDrive/Economy Investigation'
 
-dice_file_name = 'dice_progression.parquet'
-print('reading dice_progression')
-dice_progression = pd.read_parquet(data_path + '/' + dice_file_name)
-
-mb_file_name = 'mb_progression.parquet'
-print('reading mb_progression')
-mb_progression = pd.read_parquet(data_path + '/' + mb_file_name)
-
-puzzle_file_name = 'puzzle_progression.parquet'
-print('reading puzzle_progression')
-puzzle_progression = pd.read_parquet(data_path + '/' + puzzle_file_name)
-
-player_balance_file_name = 'player_balance.parquet'
-print('reading player_balance')
-player_balance = pd.read_parquet(data_path + '/' + player_balance_file_name)
+# monetization_plan is a date-keyed dimension table written by read-data-from-snowflake.py;
+# the sheet is only read when it has not been saved yet.
+if dataset_available('monetization_plan'):
+    print('reading monetization_plan')
+    monetization_plan = read_dataset('monetization_plan')
+else:
+    # add spreadsheet key
+    spreadsheet = gc.open_by_key('')
+    worksheet = spreadsheet.worksheet('monetization_plan')
+    monetization_plan = pd.DataFrame(worksheet.get())
+    monetization_plan.columns = monetization_plan.iloc[0]
+    monetization_plan = monetization_plan.drop(0)
+    monetization_plan.columns = monetization_plan.columns.str.strip().str.lower().str.replace(' ', '_')
+    monetization_plan = monetization_plan[['date', 'special_holiday', 'campaign', 'new_features', 'cycle', 'main_story', 'album', 'puzzle_/_th', 'trail_/_dice', 'theme_path']]
+    monetization_plan.rename(columns={'date': 'promo_date'}, inplace=True)
+    monetization_plan = apply_schema(monetization_plan, 'monetization_plan')   # data-schema.py
+
+# Datasets are read on demand: each analysis cell calls load_dataset() (parquet-storage.py)
+# with the columns and date range it needs, so only those partitions and columns are read.
+# eager_load reads every dataset in full up front, as global DataFrames.
+eager_load = False   #@param {type:"boolean"}
+
+release_dataset()   # a re-run of this cell drops frames loaded from an earlier ingest/load
+for name in ('dice_progression', 'mb_progression', 'puzzle_progression', 'player_balance', 'energy_quantiles'):
+    if not dataset_available(name):
+        continue
+    if eager_load:
+        globals()[name] = load_dataset(name)
+        print(f'{name} in memory: {memory_mb(globals()[name]):,.0f} MB')
+    else:
+        print(f'{name} available (loaded on first use)')
 print('data read sucssufully')
 
@@ -4,6 +4,14 @@ import pandas as pd
 from google.auth import default
 from google.colab import auth
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import glob
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
 from google.colab import drive
 auth.authenticate_user()
 creds, _ = default()
@@ -13,9 +21,99 @@ drive.mount('/content/drive')
 
 data_path = '/content/drive/MyDrive/Economy Investigation'
 
+# ----------------------------
+# Summary mode (energy percentiles computed in Snowflake)
+# ----------------------------
+# The energy trend cells only plot per-day percentiles split by is_payer. Summary mode
+# has the warehouse compute exactly those and ships a few thousand rows
+# (energy_quantiles.parquet) instead of every player-day row of player_balance.
+summary_mode    = False   #@param {type:"boolean"}
+exact_quantiles = True    #@param {type:"boolean"}  # False -> approx_percentile, cheaper on long windows
+summary_qs      = [0.5, 0.75, 0.9, 0.95, 0.99]
+
+# ----------------------------
+# Incremental ingest (player_balance is stored as promo_date partitions)
+# ----------------------------
+lookback_days      = 191
+incremental_ingest = True   #@param {type:"boolean"}
+backfill_days      = 2      #@param {type:"integer"}  # newest stored days to re-pull for late-arriving rows
+
+player_balance_dir     = dataset_path('player_balance')   # parquet-storage.py
+player_balance_staging = staging_path('player_balance')   # fresh partitions land here first
+
+def pb_stored_dates():
+    """promo_date partitions already present in the player_balance dataset (sorted)."""
+    if not os.path.isdir(player_balance_dir):
+        return []
+    return sorted(
+        date.fromisoformat(name.split('=', 1)[1])
+        for name in os.listdir(player_balance_dir)
+        if name.startswith('promo_date=')
+    )
+
+def pb_drop_partitions(dates):
+    for d in dates:
+        shutil.rmtree(f"{player_balance_dir}/promo_date={d.isoformat()}", ignore_errors=True)
+
+def pb_commit_staging():
+    """Expire old days and swap the staged partitions in (replacing the same days); returns #partitions."""
+    if pb_stored:
+        pb_expire_before = date.today() - timedelta(days=lookback_days)
+        pb_drop_partitions([d for d in pb_stored if d < pb_expire_before])
+    return commit_staging('player_balance', partitions_only=bool(pb_stored))   # also queues the Drive upload
+
+def pb_layout_is_current():
+    # partitions written before monetization_plan became its own table carry the plan columns
+    first = next(glob.iglob(player_balance_dir + '/promo_date=*/*.parquet'), None)
+    return first is None or 'main_story' not in pq.read_schema(first).names
+
+if incremental_ingest and not summary_mode:
+    mirror_pull(player_balance_dir)   # the stored days are read and extended in the local mirror
+pb_stored = pb_stored_dates() if incremental_ingest and not summary_mode and pb_layout_is_current() else []
+pb_window_start = f"current_date - interval '{lookback_days} day'"
+if summary_mode:
+    pb_fetch_start = None
+    pb_start_sql = pb_window_start
+    print(f'summary mode: fetching daily energy percentiles for the last {lookback_days} days')
+elif pb_stored:
+    pb_fetch_start = pb_stored[-1] - timedelta(days=max(backfill_days - 1, -1))
+    pb_start_sql = f"greatest({pb_window_start}, '{pb_fetch_start.isoformat()}'::date)"
+    print(f'incremental ingest: {len(pb_stored)} days stored, fetching from {pb_fetch_start}')
+else:
+    pb_fetch_start = None
+    pb_start_sql = pb_window_start
+    print(f'full ingest: fetching the last {lookback_days} days')
+
+# Partitions are keyed by promo_date = to_date(max_event_timestamp), and a fetched partition
+# replaces the stored one, so the window filters on promo_date itself; event_date, which can
+# fall a day on either side of it, is only a pruning bound widened by pb_event_margin_days.
+pb_event_margin_days = 1
+
+def pb_window_sql(start_sql: str) -> str:
+    """WHERE conditions selecting every row of the promo_dates from start_sql up to two days ago."""
+    return (f"to_date(max_event_timestamp) >= {start_sql}\n"
+            f"    and to_date(max_event_timestamp) < current_date - 1\n"
+            f"    and event_date >= dateadd(day, -{pb_event_margin_days}, {start_sql})\n"
+            f"    and event_date < dateadd(day, {pb_event_margin_days}, current_date - 1)")
+
+# leftovers of an interrupted run
+for name, layout in DATASET_LAYOUTS.items():
+    if layout['partition']:
+        shutil.rmtree(staging_path(name), ignore_errors=True)
+
+spreadsheet = gc.open_by_key('1Va9Hzlc9QJcTtIb4h_5YP5_pBCNsP_bNEnOTGyXEOvQ')
+worksheet = spreadsheet.worksheet('monetization_plan')
+monetization_plan = pd.DataFrame(worksheet.get())
+monetization_plan.columns = monetization_plan.iloc[0]
+monetization_plan = monetization_plan.drop(0)
+monetization_plan.columns = monetization_plan.columns.str.strip().str.lower().str.replace(' ', '_')
+monetization_plan = monetization_plan[['date', 'special_holiday', 'campaign', 'new_features', 'cycle', 'main_story', 'album', 'puzzle_/_th', 'trail_/_dice', 'theme_path']]
+monetization_plan.rename(columns={'date': 'promo_date'}, inplace=True)
+monetization_plan = apply_schema(monetization_plan, 'monetization_plan')   # data-schema.py
+
 print('running query')
 
-query = """
+query = f"""
 with q as (
   select
     max_event_timestamp as promo_ts,
@@ -25,8 +123,7 @@ with q as (
     energy_balance_eop,
     total_energy_out
   from fish_of_fortune_prod.dwh.fact_daily_activities
-  where event_date >= current_date - interval '191 day'
-    and event_date < current_date - 1
+  where {pb_window_sql(pb_start_sql)}
     and player_id not in (
       select player_id
       from fish_of_fortune_prod.dwh.dim_test_users
@@ -49,14 +146,41 @@ from q
 order by promo_date
 """
 
-cur = ctx.cursor()
-try:
-    cur.execute(query)
-    player_balance = cur.fetch_pandas_all()     # returns a pandas DataFrame directly
-finally:
-    cur.close()
+def summary_quantile_sql(q):
+    alias = f"p{int(q*100)}"
+    if exact_quantiles:
+        return f"percentile_cont({q}) within group (order by value) as {alias}"
+    return f"approx_percentile(value, {q}) as {alias}"
 
-print("Energy query ran successfully")
+# One row per (promo_date, segment, metric); segment 'All' is the grouping-set total, the
+# others are is_payer cast to int ('0' / '1' whether the column is a number or a boolean).
+# UNPIVOT drops nulls, matching pandas' NaN-skipping quantiles.
+summary_query = f"""
+with q as (
+  select
+    to_date(max_event_timestamp) as promo_date,
+    is_payer,
+    energy_balance_bop::float as energy_balance_bop,
+    energy_balance_eop::float as energy_balance_eop,
+    total_energy_out::float   as total_energy_out
+  from fish_of_fortune_prod.dwh.fact_daily_activities
+  where {pb_window_sql(pb_window_start)}
+    and player_id not in (
+      select player_id
+      from fish_of_fortune_prod.dwh.dim_test_users
+      where is_player_tests = 1
+    )
+)
+select
+  promo_date,
+  case when grouping(is_payer) = 1 then 'All' else to_varchar(is_payer::int) end as segment,
+  lower(metric) as metric,
+  {', '.join(summary_quantile_sql(q) for q in summary_qs)}
+from q
+  unpivot (value for metric in (energy_balance_bop, energy_balance_eop, total_energy_out))
+group by grouping sets ((promo_date, metric), (promo_date, is_payer, metric))
+order by promo_date, metric, segment
+"""
 
 mb_query = """
 with mb_progression as (
@@ -104,18 +228,15 @@ select
     c.days_live
 from mb_progression as m
 left join calendar_event_start as c
-  on m.calendar_id = c.calendar_id;
+  on m.calendar_id = c.calendar_id
+-- keep each player's best position per event start (replaces the client-side sort + drop_duplicates)
+qualify row_number() over (
+  partition by m.player_id, c.mb_event_start
+  order by m.last_position desc
+) = 1
+order by c.mb_event_start;
 """
 
-cur = ctx.cursor()
-try:
-    cur.execute(mb_query)
-    mb_progression = cur.fetch_pandas_all()     # returns a pandas DataFrame directly
-finally:
-    cur.close()
-
-print("MB query ran successfully")
-
 dice_query = """
 with calendar as(
     select
@@ -168,15 +289,9 @@ left join calendar as c
   on d.calendar_id = c.calendar_id
   where c.starts_at >= current_date - interval '191 day'
         and c.starts_at < current_timestamp
-  group by all;
+  group by all
+  order by starts_at;
 """
-cur = ctx.cursor()
-try:
-    cur.execute(dice_query)
-    dice_progression = cur.fetch_pandas_all()     # returns a pandas DataFrame directly
-finally:
-    cur.close()
-
 
 puzzle_query = """
 with calendar as (
@@ -221,39 +336,177 @@ select
     c.ends_at
 from puzzle_progression p
 join calendar c
-on p.calendar_id = c.calendar_id;
+on p.calendar_id = c.calendar_id
+order by c.starts_at;
 """
 
-cur = ctx.cursor()
-try:
-    cur.execute(puzzle_query)
-    puzzle_progression = cur.fetch_pandas_all()     # returns a pandas DataFrame directly
-finally:
-    cur.close()
-
-
-print("all queries ran successfully")
-
-player_balance.columns = player_balance.columns.str.strip().str.lower().str.replace(' ', '_')
-
-# duplicates = player_balance[player_balance.duplicated(subset=['player_id', 'promo_date'], keep=False)]
-# duplicates.sort_values(by=['player_id', 'promo_date'], inplace=True)
-
-# # Display summary
-# print(f"Total duplicates: {len(duplicates)}")
-# print(f"Unique players affected: {duplicates['player_id'].nunique()}")
+# ----------------------------
+# Per-dataset cleanup (applied to the full frame or to each streamed batch)
+# ----------------------------
+def normalise_columns(df):
+    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
+    return df
+
+def clean_energy_quantiles(df):
+    return apply_schema(normalise_columns(df), 'energy_quantiles')
+
+def clean_player_balance(df):
+    # plan attributes stay in the monetization_plan dimension table (plan_lookup in data-schema.py)
+    return apply_schema(normalise_columns(df), 'player_balance')
+
+def clean_mb_progression(df):
+    return apply_schema(normalise_columns(df), 'mb_progression')
+
+def clean_dice_progression(df):
+    df = normalise_columns(df)
+    df['dice_event_start'] = pd.to_datetime(df['starts_at']).dt.normalize()
+    df['dice_event_end'] = pd.to_datetime(df['ends_at']).dt.normalize()
+    return apply_schema(df, 'dice_progression')
+
+def clean_puzzle_progression(df):
+    df = normalise_columns(df)
+    df['puzzle_event_starts_at'] = pd.to_datetime(df['starts_at']).dt.normalize()
+    df['puzzle_event_ends_at'] = pd.to_datetime(df['ends_at']).dt.normalize()
+    return apply_schema(df, 'puzzle_progression')
+
+dataset_cleaners = {
+    'energy_quantiles': clean_energy_quantiles,
+    'player_balance': clean_player_balance,
+    'mb_progression': clean_mb_progression,
+    'dice_progression': clean_dice_progression,
+    'puzzle_progression': clean_puzzle_progression,
+}
+
+# ----------------------------
+# Run the extraction queries
+# ----------------------------
+# The four queries are independent, so by default they are submitted together on
+# separate cursors of the shared connection and collected as each one finishes.
+concurrent_queries = True   #@param {type:"boolean"}
+# Streaming: fetch Arrow batches, clean each batch and append it to parquet as its own
+# row group, so peak memory is one batch instead of the whole result.
+streaming_fetch    = False  #@param {type:"boolean"}
+# Serve repeated queries from the local result cache (query-cache.py); streamed pulls bypass it.
+use_query_cache    = True   #@param {type:"boolean"}
+query_cache_refresh = []    # dataset names to re-run even when cached, e.g. ['player_balance']
 
-spreadsheet = gc.open_by_key('1Va9Hzlc9QJcTtIb4h_5YP5_pBCNsP_bNEnOTGyXEOvQ')
-worksheet = spreadsheet.worksheet('monetization_plan')
-monetization_plan = pd.DataFrame(worksheet.get())
-monetization_plan.columns = monetization_plan.iloc[0]
-monetization_plan = monetization_plan.drop(0)
-monetization_plan.columns = monetization_plan.columns.str.strip().str.lower().str.replace(' ', '_')
-monetization_plan = monetization_plan[['date', 'special_holiday', 'campaign', 'new_features', 'cycle', 'main_story', 'album', 'puzzle_/_th', 'trail_/_dice', 'theme_path']]
-monetization_plan.rename(columns={'date': 'promo_date'}, inplace=True)
-monetization_plan['promo_date'] = pd.to_datetime(monetization_plan['promo_date']).dt.date
-
-player_balance = pd.merge(player_balance, monetization_plan[['promo_date', 'special_holiday', 'campaign', 'new_features', 'cycle', 'main_story', 'album', 'puzzle_/_th']], on='promo_date', how='left')
+try:
+    cached_query
+except NameError:
+    use_query_cache = False   # query-cache.py cell was not run
+
+extraction_queries = {'energy_quantiles': summary_query} if summary_mode else {'player_balance': query}
+extraction_queries.update({
+    'mb_progression': mb_query,
+    'dice_progression': dice_query,
+    'puzzle_progression': puzzle_query,
+})
+
+def run_query(name, sql):
+    """Run one query on its own cursor; returns (DataFrame, elapsed seconds)."""
+    started = time.perf_counter()
+    if use_query_cache:
+        df = cached_query(ctx, sql, refresh=name in query_cache_refresh, name=name)
+        return df, time.perf_counter() - started
+    cur = ctx.cursor()
+    try:
+        cur.execute(sql)
+        df = cur.fetch_pandas_all()     # returns a pandas DataFrame directly
+    finally:
+        cur.close()
+    return df, time.perf_counter() - started
+
+def stream_schema(schema):
+    """Widen the first batch's schema so later batches fit (int widths vary, all-null columns)."""
+    fields = []
+    for field in schema:
+        if pa.types.is_integer(field.type):
+            field = field.with_type(pa.int64())
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    return pa.schema(fields, metadata=schema.metadata)
+
+def stream_query(name, sql):
+    """Fetch, clean and write one query batch by batch; returns (rows written, elapsed seconds)."""
+    started = time.perf_counter()
+    clean = dataset_cleaners[name]
+    partitioned = DATASET_LAYOUTS[name]['partition'] is not None
+    file_path = dataset_path(name)
+    schema, writer, rows = None, None, 0
+    cur = ctx.cursor()
+    try:
+        cur.execute(sql)
+        for batch_no, batch in enumerate(cur.fetch_pandas_batches()):
+            # rows arrive ordered by partition column from SQL; the layout sort applies per batch
+            table = schema_table(sort_for_layout(clean(batch), name), name)
+            if schema is None:
+                schema = stream_schema(table.schema)
+            table = table.cast(schema)
+            if partitioned:
+                write_partitions(table, name, staging_path(name),
+                                 basename_template=f'batch-{batch_no:05d}-{{i}}.parquet')
+            else:
+                if writer is None:
+                    writer = parquet_writer(file_path + '.tmp', schema)
+                writer.write_table(table)     # one row group per batch
+            rows += len(table)
+    finally:
+        cur.close()
+        if writer is not None:
+            writer.close()
+    if writer is not None:
+        os.replace(file_path + '.tmp', file_path)
+        mirror_push(file_path)
+    return rows, time.perf_counter() - started
+
+query_results, query_errors = {}, {}
+
+def collect_query(name, get_result):
+    try:
+        result, elapsed = get_result()
+    except Exception as e:
+        query_errors[name] = e
+        print(f"{name} query failed: {e!r}")
+        return
+    query_results[name] = result
+    rows = result if isinstance(result, int) else len(result)
+    print(f"{name} query ran successfully ({elapsed:.1f}s, {rows:,} rows)")
+
+execute_query = stream_query if streaming_fetch else run_query
+
+queries_started = time.perf_counter()
+if concurrent_queries:
+    with ThreadPoolExecutor(max_workers=len(extraction_queries)) as pool:
+        futures = {pool.submit(execute_query, name, sql): name for name, sql in extraction_queries.items()}
+        for future in as_completed(futures):
+            collect_query(futures[future], future.result)
+else:
+    for name, sql in extraction_queries.items():
+        collect_query(name, lambda: execute_query(name, sql))
+
+if query_errors:
+    raise RuntimeError(f"{len(query_errors)} extraction queries failed: {', '.join(query_errors)}")
+
+if streaming_fetch:
+    # Batches were cleaned and staged as they arrived; swap them in and load the small datasets back
+    for name in ('mb_progression', 'dice_progression', 'puzzle_progression'):
+        commit_staging(name)
+    if summary_mode:
+        energy_quantiles = read_dataset('energy_quantiles')
+    mb_progression     = read_dataset('mb_progression')
+    dice_progression   = read_dataset('dice_progression')
+    puzzle_progression = read_dataset('puzzle_progression')
+else:
+    if summary_mode:
+        energy_quantiles = clean_energy_quantiles(query_results['energy_quantiles'])
+    else:
+        player_balance = clean_player_balance(query_results['player_balance'])
+    mb_progression     = clean_mb_progression(query_results['mb_progression'])
+    dice_progression   = clean_dice_progression(query_results['dice_progression'])
+    puzzle_progression = clean_puzzle_progression(query_results['puzzle_progression'])
+
+print(f"all queries ran successfully ({time.perf_counter() - queries_started:.1f}s wall time)")
 
 # duplicates = player_balance[player_balance.duplicated(subset=['player_id', 'promo_date'], keep=False)]
 # duplicates.sort_values(by=['player_id', 'promo_date'], inplace=True)
@@ -262,34 +515,47 @@ player_balance = pd.merge(player_balance, monetization_plan[['promo_date', 'spec
 # print(f"Total duplicates: {len(duplicates)}")
 # print(f"Unique players affected: {duplicates['player_id'].nunique()}")
 
-mb_file_name = 'mb_progression.parquet'
-print('saving mb_progression data')
-mb_progression.to_parquet(data_path + '/' + mb_file_name, index=False)
-player_balance_file_name = 'player_balance.parquet'
-print('saving player_balance data')
-player_balance.to_parquet(data_path + '/' + player_balance_file_name, index=False)
-
-mb_progression.columns = mb_progression.columns.str.strip().str.lower().str.replace(' ', '_')
-mb_progression = (
-    mb_progression.sort_values(['player_id', 'mb_event_start', 'last_position'], ascending=[True, True, False])
-    .drop_duplicates(subset=['player_id', 'mb_event_start'], keep='first')
-)
-mb_progression.sort_values(by='mb_event_start', inplace=True)
-duplicates = mb_progression[mb_progression.duplicated(subset=['player_id', 'mb_event_start'], keep=False)]
-duplicates.sort_values(by=['player_id', 'mb_event_start'], inplace=True)
+print('saving monetization_plan data')
+write_dataset(monetization_plan, 'monetization_plan')
+
+if summary_mode:
+    if not streaming_fetch:
+        print('saving energy_quantiles data')
+        write_dataset(energy_quantiles, 'energy_quantiles')
+else:
+    # Fresh days are staged first, then swapped in: only the partitions present in this
+    # pull (new + backfilled days) are rewritten and days past the lookback window expire.
+    print('saving player_balance data')
+    if not streaming_fetch:
+        write_dataset(player_balance, 'player_balance')   # sorted, zstd, into the staging area
+        # only the pulled days when incremental: analyses read the full window via load_dataset()
+        del player_balance
+    print(f'committed {pb_commit_staging()} promo_date partitions')
+
+    # Per-day quantile sketches for weekly / monthly percentiles (quantile-sketches.py, optional)
+    try:
+        pb_sketches = sketch_enabled
+    except NameError:
+        pb_sketches = False
+    if pb_sketches:
+        print(f'built energy sketches for {sync_energy_sketches(refresh_from=pb_fetch_start)} days')
+
+    # percentiles from an earlier summary-mode run describe an older window
+    if dataset_available('energy_quantiles'):
+        delete_dataset('energy_quantiles')
+
+# mb_query already keeps one row per (player_id, mb_event_start); check it with a count
+mb_dup_mask = mb_progression.duplicated(subset=['player_id', 'mb_event_start'])
 
 # Display summary
-print(f"Total duplicates: {len(duplicates)}")
-print(f"Unique players affected: {duplicates['player_id'].nunique()}")
+print(f"Total duplicates: {int(mb_dup_mask.sum())}")
+print(f"Unique players affected: {mb_progression.loc[mb_dup_mask, 'player_id'].nunique()}")
 
-mb_file_name = 'mb_progression.parquet'
-print('saving mb_progression data')
-mb_progression.to_parquet(data_path + '/' + mb_file_name, index=False)
+if not streaming_fetch:
+    print('saving mb_progression data')
+    write_dataset(mb_progression, 'mb_progression')
+    commit_staging('mb_progression')
 
-dice_progression.columns = dice_progression.columns.str.strip().str.lower().str.replace(' ', '_')
-dice_progression.sort_values(by='starts_at', inplace=True)
-dice_progression['dice_event_start'] = pd.to_datetime(dice_progression['starts_at']).dt.date
-dice_progression['dice_event_end'] = pd.to_datetime(dice_progression['ends_at']).dt.date
 # # Check for duplicates by player_id and dice_event_start
 # duplicates = dice_progression[dice_progression.duplicated(subset=['player_id', 'dice_event_start'], keep=False)]
 
@@ -297,21 +563,38 @@ dice_progression['dice_event_end'] = pd.to_datetime(dice_progression['ends_at'])
 # print(f"Total duplicates: {len(duplicates)}")
 # print(f"Unique players affected: {duplicates['player_id'].nunique()}")
 
-dice_file_name = 'dice_progression.parquet'
-print('saving dice_progression data')
-dice_progression.to_parquet(data_path + '/' + dice_file_name, index=False)
+if not streaming_fetch:
+    print('saving dice_progression data')
+    write_dataset(dice_progression, 'dice_progression')
+    commit_staging('dice_progression')
 
-puzzle_progression.columns = puzzle_progression.columns.str.strip().str.lower().str.replace(' ', '_')
-puzzle_progression.sort_values(by='starts_at', inplace=True)
-puzzle_progression['puzzle_event_starts_at'] = pd.to_datetime(puzzle_progression['starts_at']).dt.date
-puzzle_progression['puzzle_event_ends_at'] = pd.to_datetime(puzzle_progression['ends_at']).dt.date
 # puzzle_progression.sort_values(by='puzzle_event_starts_at', inplace=True)
 # duplicates = puzzle_progression[puzzle_progression.duplicated(subset=['player_id', 'puzzle_event_starts_at', 'puzzle_config_display_name'], keep=False)]
 # duplicates.sort_values(by=['player_id', 'puzzle_event_starts_at'], inplace=True)
 
-puzzle_file_name = 'puzzle_progression.parquet'
-print('saving puzzle_progression data')
-puzzle_progression.to_parquet(data_path + '/' + puzzle_file_name, index=False)
-
+if not streaming_fetch:
+    print('saving puzzle_progression data')
+    write_dataset(puzzle_progression, 'puzzle_progression')
+    commit_staging('puzzle_progression')
 
+# Deduplicated players per (event, config, position) for the progression views (progression-cube.py, optional)
+try:
+    pc_enabled = progression_cube_enabled
+except NameError:
+    pc_enabled = False
+if pc_enabled:
+    print('saving progression_cube data')
+    write_dataset(build_progression_cube({'mb': mb_progression, 'dice': dice_progression, 'puzzle': puzzle_progression}),
+                  'progression_cube')
+
+# The analysis cells get these frames from load_dataset() without re-reading parquet
+release_dataset()
+register_dataset('mb_progression', mb_progression)
+register_dataset('dice_progression', dice_progression)
+register_dataset('puzzle_progression', puzzle_progression)
+if summary_mode:
+    register_dataset('energy_quantiles', energy_quantiles)
+
+if mirror_enabled:
+    print('Drive copies are being written in the background; run mirror_flush() before closing the runtime')
 print('data saved sucssufully')
@@ -0,0 +1,17 @@
+import os
+import re
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_cells(*names, params=None, namespace=None) -> dict:
+    """Execute the notebook cells <name>.py in order in one namespace (as Colab shares globals),
+    with their #@param assignments replaced by `params`."""
+    ns = {} if namespace is None else namespace
+    for name in names:
+        path = os.path.join(REPO, f'{name}.py')
+        with open(path) as fh:
+            source = fh.read()
+        for param, value in (params or {}).items():
+            source = re.sub(rf'^{param}(\s*)=.*#@param.*$', rf'{param}\1= {value!r}', source, flags=re.M)
+        exec(compile(source, path, 'exec'), ns)
+    return ns
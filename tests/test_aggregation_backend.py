@@ -0,0 +1,66 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from conftest import load_cells
+
+pytest.importorskip('duckdb')
+
+@pytest.fixture(scope='module')
+def backend(tmp_path_factory):
+    root = tmp_path_factory.mktemp('agg')
+    ns = {'data_path': str(root / 'drive')}
+    (root / 'drive').mkdir()
+    load_cells('data-schema', 'parquet-storage', 'aggregation-backend', namespace=ns,
+               params={'mirror_enabled': False, 'hot_cache_enabled': False, 'aggregation_engine': 'duckdb'})
+    rng = np.random.default_rng(7)
+    n = 6000
+    balance = pd.DataFrame({
+        'promo_date': pd.Timestamp('2025-10-01') + pd.to_timedelta(rng.integers(0, 6, n), 'D'),
+        'player_id': rng.integers(0, 2000, n), 'is_payer': rng.integers(0, 2, n),
+        'energy_balance_bop': rng.integers(0, 10**5, n).astype(float),
+        'energy_balance_eop': rng.integers(0, 10**5, n).astype(float),
+        'total_energy_out': rng.integers(0, 10**4, n),
+    })
+    balance.loc[rng.choice(n, 300, replace=False), 'energy_balance_eop'] = np.nan
+    mb = pd.DataFrame({
+        'player_id': rng.integers(0, 2000, n), 'calendar_id': rng.choice(['c1', 'c2'], n),
+        'config_id': rng.choice(['m1', 'm2', 'm3', 'm4'], n), 'is_payer': rng.integers(0, 2, n),
+        'last_position': rng.integers(0, 30, n),
+        'mb_event_start': pd.Timestamp('2025-09-01') + pd.to_timedelta(rng.integers(0, 5, n) * 7, 'D'),
+    })
+    for name, df in (('player_balance', balance), ('mb_progression', mb)):
+        ns['write_dataset'](df, name)
+        ns['commit_staging'](name)
+    return ns
+
+def both_engines(ns, fn, *args, **kwargs):
+    out = {}
+    for engine in ('pandas', 'duckdb'):
+        ns['aggregation_engine'] = engine
+        ns['release_dataset']()
+        out[engine] = ns[fn](*args, **kwargs)
+    return out['pandas'], out['duckdb']
+
+@pytest.mark.parametrize('dates', [None, [date(2025, 10, 2), date(2025, 10, 4)], []])
+def test_daily_quantiles_match(backend, dates):
+    qs = [0.5, 0.9, 0.99]
+    expected, actual = both_engines(backend, 'agg_daily_quantiles', 'player_balance',
+                                    ['energy_balance_eop', 'total_energy_out'], qs, dates=dates)
+    assert list(expected) == list(actual)
+    for col in expected:
+        assert_frame_equal(actual[col], expected[col], check_exact=False, rtol=1e-9)
+
+@pytest.mark.parametrize('where', [None, {'config_id': ['m2', 'm4']}])
+def test_unique_players_match(backend, where):
+    expected, actual = both_engines(backend, 'agg_unique_players', 'mb_progression',
+                                    ['mb_event_start', 'config_id', 'last_position'], where=where)
+    assert_frame_equal(actual, expected)
+
+def test_grouped_match(backend):
+    expected, actual = both_engines(backend, 'agg_grouped', 'mb_progression', ['config_id'], 'last_position', 'max',
+                                    where={'calendar_id': ['c2']})
+    assert_frame_equal(actual, expected)
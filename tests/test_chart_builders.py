@@ -0,0 +1,66 @@
+import matplotlib
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import load_cells
+
+matplotlib.use('Agg')
+
+@pytest.fixture
+def charts():
+    ns = load_cells('data-schema', 'plot-renderer', 'chart-builders')
+    ns['monetization_plan'] = pd.DataFrame({
+        'promo_date': pd.date_range('2025-10-01', periods=6),
+        'main_story': ['s1', 's1', None, 's1', 's2', 's2'],
+    })
+    return ns
+
+def test_campaign_starts_follow_the_covered_days(charts):
+    starts = charts['campaign_starts'](pd.date_range('2025-10-01', periods=6))
+    # a story that resumes after a day without one starts again
+    assert starts['promo_date'].dt.day.tolist() == [1, 4, 5]
+    # days without data are not compared
+    starts = charts['campaign_starts'](pd.to_datetime(['2025-10-01', '2025-10-04']))
+    assert starts['promo_date'].dt.day.tolist() == [1]
+
+def test_story_firsts_join_stories_of_a_day(charts):
+    charts['monetization_plan'].loc[4, 'main_story'] = 's3'   # s2 then first appears on day 6
+    charts['monetization_plan'].loc[5, 'main_story'] = ' s2 '
+    charts['monetization_plan'].loc[len(charts['monetization_plan'])] = [pd.Timestamp('2025-10-05'), 's4']
+    firsts = charts['story_firsts']()
+    assert firsts.to_dict('list') == {
+        'promo_date': list(pd.to_datetime(['2025-10-01', '2025-10-05', '2025-10-06'])),
+        'main_story': ['s1', 's3 • s4', 's2'],
+    }
+
+def test_chart_energy_lines_and_markers(charts):
+    days = pd.date_range('2025-10-02', periods=3)
+    eop = pd.DataFrame({0.5: [1.0, 2.0, 3.0], 0.9: [4.0, 5.0, 6.0]}, index=days)
+    bop = eop - 1
+    view = charts['render_view']('test_energy')
+    charts['chart_energy'](view, [('eop ', eop, {'linestyle': '-'}), ('bop ', bop, {'linestyle': '--'})],
+                           [0.5, 0.9], charts['percentile_labels']([0.5, 0.9]), 'Balance', 'Balance',
+                           charts['campaign_starts'](pd.date_range('2025-10-01', periods=6)))
+    legend = [t.get_text() for t in view['ax'].get_legend().get_texts()]
+    assert legend == ['eop 50th percentile', 'bop 50th percentile', 'eop 90th percentile', 'bop 90th percentile']
+    # only the start inside the plotted days (10-04) is marked
+    assert [t.get_text() for t in view['texts']['markers'] if t.get_visible()] == ['s1']
+    assert view['ax'].get_title() == 'Balance'
+
+    charts['chart_energy'](view, [('eop ', eop.iloc[:0], {})], [0.5], charts['percentile_labels']([0.5]),
+                           'Balance', 'Balance', charts['campaign_starts'](days))
+    assert view['ax'].get_title() == 'No data for the selected filters'
+    assert not any(t.get_visible() for t in view['texts']['markers'])
+
+def test_chart_puzzle_levels_percentages(charts):
+    view = charts['render_view']('test_puzzle', figsize=(14, 5))
+    players = np.array([[1, 3, 0], [0, 0, 0], [2, 2, 0]])
+    events = pd.DatetimeIndex(pd.date_range('2025-10-01', periods=3))
+    charts['chart_puzzle_levels'](view, players, events, pd.Index([1, 2, 3]), 'Puzzle')
+    labels = sorted(t.get_text() for t in view['texts']['segments'] if t.get_visible())
+    assert labels == ['25%', '50%', '50%', '75%']   # empty event and level dropped
+    assert [t.get_text() for t in view['ax'].get_xticklabels()] == ['2025-10-01', '2025-10-03']
+
+    charts['chart_puzzle_levels'](view, np.zeros((3, 3)), events, pd.Index([1, 2, 3]), 'Puzzle')
+    assert view['ax'].get_title() == 'No data after aggregation.'
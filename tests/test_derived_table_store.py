@@ -0,0 +1,78 @@
+import os
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pytest
+
+from conftest import load_cells
+
+@pytest.fixture
+def store(tmp_path):
+    ns = {'data_path': str(tmp_path / 'drive')}
+    os.makedirs(ns['data_path'])
+    load_cells('data-schema', 'parquet-storage', 'derived-table-store', namespace=ns,
+               params={'mirror_enabled': False, 'hot_cache_enabled': False})
+    rng = np.random.default_rng(3)
+    n = 600
+    ns['write_dataset'](pd.DataFrame({
+        'promo_date': pd.Timestamp('2025-10-01') + pd.to_timedelta(np.repeat(np.arange(3), 200), 'D'),
+        'player_id': rng.integers(0, 10**6, n), 'is_payer': rng.integers(0, 2, n),
+        'energy_balance_bop': rng.integers(0, 10**5, n), 'energy_balance_eop': rng.integers(0, 10**5, n),
+        'total_energy_out': rng.integers(0, 10**4, n),
+    }), 'player_balance')
+    ns['commit_staging']('player_balance')
+    return ns
+
+def partition_file(ns, day):
+    part = f"{ns['dataset_path']('player_balance')}/promo_date={day.isoformat()}"
+    return os.path.join(part, next(f for f in os.listdir(part) if f.endswith('.parquet')))
+
+def test_fingerprint_ignores_footer_metadata(store):
+    before = store['partition_fingerprints']('player_balance')
+    path = partition_file(store, date(2025, 10, 2))
+    table = pq.read_table(path)
+    pq.write_table(table.replace_schema_metadata({b'pandas': b'{"written_by": "another pandas"}'}), path,
+                   compression='zstd', compression_level=store['parquet_compression_level'])
+    assert store['partition_fingerprints']('player_balance') == before
+
+def test_fingerprint_follows_the_rows(store):
+    before = store['partition_fingerprints']('player_balance')
+    path = partition_file(store, date(2025, 10, 2))
+    table = pq.read_table(path)
+    column = table.schema.get_field_index('total_energy_out')
+    pq.write_table(table.set_column(column, 'total_energy_out', pc.add(table['total_energy_out'], 10**5)), path)
+    after = store['partition_fingerprints']('player_balance')
+    assert [d for d in before if before[d] != after[d]] == [date(2025, 10, 2)]
+
+def test_single_file_layout_is_computed_in_full(store, tmp_path):
+    legacy = {'data_path': str(tmp_path / 'legacy')}
+    os.makedirs(legacy['data_path'])
+    load_cells('data-schema', 'parquet-storage', 'derived-table-store', namespace=legacy,
+               params={'mirror_enabled': False, 'hot_cache_enabled': False})
+    rows = store['read_dataset']('player_balance')
+    rows.to_parquet(legacy['drive_path']('player_balance') + '.parquet')
+    seen = []
+
+    def compute(dates=None):
+        seen.append(dates)
+        frame = legacy['read_dataset']('player_balance')
+        return frame if dates is None else frame[frame['promo_date'].dt.date.isin(dates)]
+
+    assert len(legacy['derived_table']('pb_rows', 'player_balance', compute)) == len(rows)
+    assert seen == [None]
+
+def test_fingerprint_follows_values_within_the_same_statistics(store):
+    before = store['partition_fingerprints']('player_balance')
+    path = partition_file(store, date(2025, 10, 2))
+    table = pq.read_table(path)
+    column = table.schema.get_field_index('total_energy_out')
+    values = table['total_energy_out'].to_numpy().copy()
+    values[[0, 1]] = values[[1, 0]]   # same counts, min and max
+    assert values[0] != values[1]
+    pq.write_table(table.set_column(column, 'total_energy_out', [values]), path + '.tmp')
+    os.replace(path + '.tmp', path)
+    after = store['partition_fingerprints']('player_balance')
+    assert [d for d in before if before[d] != after[d]] == [date(2025, 10, 2)]
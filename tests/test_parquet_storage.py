@@ -0,0 +1,134 @@
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from conftest import load_cells
+
+@pytest.fixture
+def storage(tmp_path):
+    ns = {'data_path': str(tmp_path / 'drive')}
+    os.makedirs(ns['data_path'])
+    return load_cells('data-schema', 'parquet-storage', namespace=ns,
+                      params={'mirror_enabled': False, 'hot_cache_enabled': True, 'hot_cache_dir': str(tmp_path / 'hot')})
+
+def balance_rows(days, seed=0, start='2025-10-01'):
+    rng = np.random.default_rng(seed)
+    n = days * 200
+    return pd.DataFrame({
+        'promo_date': pd.Timestamp(start) + pd.to_timedelta(np.repeat(np.arange(days), 200), 'D'),
+        'player_id': rng.integers(0, 10**6, n), 'is_payer': rng.integers(0, 2, n),
+        'energy_balance_bop': rng.integers(0, 10**5, n), 'energy_balance_eop': rng.integers(0, 10**5, n),
+        'total_energy_out': rng.integers(0, 10**4, n),
+    })
+
+def cached_files(ns, name):
+    root = os.path.join(ns['hot_cache_dir'], name)
+    return sorted(os.path.relpath(os.path.join(d, f), root)
+                  for d, _, files in os.walk(root) for f in files if f.endswith('.arrow'))
+
+def test_hot_cache_keeps_projection_and_partition_pruning(storage):
+    storage['write_dataset'](balance_rows(10), 'player_balance')
+    storage['commit_staging']('player_balance')
+    columns = ['promo_date', 'energy_balance_eop']
+    filters = [('promo_date', '>=', date(2025, 10, 3)), ('promo_date', '<=', date(2025, 10, 5))]
+
+    hot = storage['read_dataset']('player_balance', columns=columns, filters=filters)
+    cold = storage['read_dataset']('player_balance', columns=columns, filters=filters, hot_cache=False)
+    assert_frame_equal(hot.reset_index(drop=True), cold.reset_index(drop=True))
+
+    files = cached_files(storage, 'player_balance')
+    assert len(files) == 3   # the three requested days, one column set
+    assert len({os.path.dirname(f) for f in files}) == 1
+    assert all(f.endswith(('2025-10-03.arrow', '2025-10-04.arrow', '2025-10-05.arrow')) for f in files)
+
+def test_hot_cache_rebuilds_only_changed_partitions(storage):
+    storage['write_dataset'](balance_rows(4), 'player_balance')
+    storage['commit_staging']('player_balance')
+    columns = ['promo_date', 'total_energy_out']
+    storage['read_dataset']('player_balance', columns=columns)
+    root = os.path.join(storage['hot_cache_dir'], 'player_balance')
+    before = {f: os.path.getmtime(os.path.join(root, f)) for f in cached_files(storage, 'player_balance')}
+
+    storage['write_dataset'](balance_rows(1, seed=1, start='2025-10-02'), 'player_balance')
+    storage['commit_staging']('player_balance', partitions_only=True)
+    hot = storage['read_dataset']('player_balance', columns=columns)
+    cold = storage['read_dataset']('player_balance', columns=columns, hot_cache=False)
+    assert_frame_equal(hot.reset_index(drop=True), cold.reset_index(drop=True))
+
+    after = {f: os.path.getmtime(os.path.join(root, f)) for f in cached_files(storage, 'player_balance')}
+    changed = sorted(f for f in after if after[f] != before[f])
+    assert len(changed) == 1 and changed[0].endswith('2025-10-02.arrow')
+
+def test_hot_cache_evicts_dropped_and_changed_partitions(storage):
+    storage['write_dataset'](balance_rows(3), 'player_balance')
+    storage['commit_staging']('player_balance')
+    storage['read_dataset']('player_balance', columns=['promo_date', 'total_energy_out'])
+    storage['read_dataset']('player_balance', columns=['promo_date', 'is_payer'])
+    assert len(cached_files(storage, 'player_balance')) == 6
+
+    storage['drop_partitions']('player_balance', [date(2025, 10, 1)])
+    storage['write_dataset'](balance_rows(1, seed=1, start='2025-10-02'), 'player_balance')
+    storage['commit_staging']('player_balance', partitions_only=True)
+    storage['read_dataset']('player_balance', columns=['promo_date', 'is_payer'],
+                            filters=[('promo_date', '==', date(2025, 10, 3))])
+    # 10-01 is gone and 10-02 changed in both column sets; only the untouched 10-03 files remain
+    files = cached_files(storage, 'player_balance')
+    assert len(files) == 2 and all(f.endswith('2025-10-03.arrow') for f in files)
+
+def test_hot_cache_drops_least_recently_read_files(storage):
+    storage['write_dataset'](balance_rows(3), 'player_balance')
+    storage['commit_staging']('player_balance')
+    day = lambda d: [('promo_date', '==', date(2025, 10, d))]
+    storage['read_dataset']('player_balance', columns=['promo_date', 'player_id'], filters=day(1))
+    storage['read_dataset']('player_balance', columns=['promo_date', 'player_id'], filters=day(2))
+    size = max(os.path.getsize(os.path.join(storage['hot_cache_dir'], 'player_balance', f))
+               for f in cached_files(storage, 'player_balance'))
+    storage['hot_cache_max_gb'] = 2.5 * size / 1024**3
+    root = os.path.join(storage['hot_cache_dir'], 'player_balance')
+    for f in cached_files(storage, 'player_balance'):   # 10-01 read more recently than 10-02
+        os.utime(os.path.join(root, f + '.source'), (0, 1000 if f.endswith('2025-10-01.arrow') else 0))
+    storage['read_dataset']('player_balance', columns=['promo_date', 'player_id'], filters=day(3))
+    assert sorted(f[-16:] for f in cached_files(storage, 'player_balance')) == ['2025-10-01.arrow', '2025-10-03.arrow']
+
+@contextmanager
+def uploads_held(ns):
+    """Keep the uploader busy inside the block, then wait for every queued upload."""
+    gate = threading.Event()
+    ns['_mirror_uploads'].submit(gate.wait)
+    try:
+        yield
+    finally:
+        gate.set()
+    ns['mirror_flush']()
+
+def test_mirror_uploads_the_tree_as_pushed(tmp_path):
+    ns = {'data_path': str(tmp_path / 'drive')}
+    os.makedirs(ns['data_path'])
+    load_cells('data-schema', 'parquet-storage', namespace=ns,
+               params={'mirror_enabled': True, 'mirror_root': str(tmp_path / 'mirror'), 'hot_cache_enabled': False})
+    local, drive = ns['dataset_path']('player_balance'), ns['drive_path']('player_balance')
+    with uploads_held(ns):
+        ns['write_dataset'](balance_rows(3), 'player_balance')
+        ns['commit_staging']('player_balance')
+        ns['drop_partitions']('player_balance', [date(2025, 10, 1)])
+        ns['write_dataset'](balance_rows(1, seed=1, start='2025-10-03'), 'player_balance')
+        ns['commit_staging']('player_balance', partitions_only=True)   # replaces a pushed partition
+        assert list(ns['_mirror_queued']) == [local]   # the three pushes wait as one upload
+    assert sorted(os.listdir(drive)) == ['promo_date=2025-10-02', 'promo_date=2025-10-03']
+    pushed = pd.read_parquet(drive, columns=['promo_date', 'player_id']).sort_values(['promo_date', 'player_id'])
+    kept = ns['read_dataset']('player_balance', columns=['promo_date', 'player_id']).sort_values(['promo_date', 'player_id'])
+    assert pushed['player_id'].tolist() == kept['player_id'].tolist()
+    assert not os.listdir(tmp_path / 'mirror' / '.snapshots')
+
+    # changes made after a push do not leak into its upload
+    with uploads_held(ns):
+        ns['drop_partitions']('player_balance', [date(2025, 10, 2)])
+        shutil.rmtree(f"{local}/promo_date=2025-10-03")   # e.g. commit_staging clearing the target
+    assert sorted(os.listdir(drive)) == ['promo_date=2025-10-03']
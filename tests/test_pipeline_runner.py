@@ -0,0 +1,65 @@
+import os
+from collections import deque
+
+import pytest
+
+from conftest import load_cells
+
+@pytest.fixture
+def runner(tmp_path):
+    ns = {'data_path': str(tmp_path / 'drive')}
+    os.makedirs(ns['data_path'])
+    load_cells('data-schema', 'parquet-storage', 'derived-table-store', 'pipeline-runner', namespace=ns,
+               params={'mirror_enabled': False, 'hot_cache_enabled': False})
+    ns['aggregation_engine'] = 'pandas'
+    ns['calls'] = deque()   # not a plain value, so not part of the key
+    # a stage defined the way a cell defines it, reading a #@param-style global and a nested lambda's global
+    exec("threshold = 1000\n"
+         "stage_qs = [0.5, 0.9]\n"
+         "@pipeline_stage('counts')\n"
+         "def counts_stage():\n"
+         "    calls.append(1)\n"
+         "    scale = lambda: [q * threshold for q in stage_qs]\n"
+         "    return scale()\n", ns)
+    return ns
+
+def test_unchanged_stage_is_cached(runner):
+    runner['run_pipeline'](['counts'])
+    runner['run_pipeline'](['counts'])
+    assert len(runner['calls']) == 1
+
+@pytest.mark.parametrize('name, value', [('threshold', 500), ('stage_qs', [0.5, 0.99]), ('aggregation_engine', 'duckdb')])
+def test_globals_read_by_the_stage_are_part_of_the_key(runner, name, value):
+    first = runner['run_pipeline'](['counts'])['counts']
+    runner[name] = value
+    second = runner['run_pipeline'](['counts'])['counts']
+    assert len(runner['calls']) == 2
+    if name != 'aggregation_engine':
+        assert second != first
+
+def test_values_persist_across_sessions(runner):
+    first = runner['run_pipeline'](['counts'])['counts']
+    runner['_stage_cache'].clear()   # what a kernel restart loses
+    assert runner['run_pipeline'](['counts'])['counts'] == first
+    assert len(runner['calls']) == 1
+    runner['threshold'] = 500
+    runner['run_pipeline'](['counts'])
+    assert len(runner['calls']) == 2
+
+def test_changed_branches_run_together(runner):
+    exec("@pipeline_stage('other')\n"
+         "def other_stage():\n"
+         "    calls.append(2)\n"
+         "    return threshold\n"
+         "@pipeline_stage('broken')\n"
+         "def broken_stage():\n"
+         "    raise ValueError('no data')\n", runner)
+    runner['run_pipeline'](['counts'])
+    assert sorted(runner['calls']) == [1, 2]   # 'other' ran with the request, 'broken' did not raise
+    runner['threshold'] = 500
+    runner['run_pipeline'](['counts'])
+    assert sorted(runner['calls']) == [1, 1, 2, 2]
+    assert runner['run_pipeline'](['other'])['other'] == 500
+    assert sorted(runner['calls']) == [1, 1, 2, 2]
+    with pytest.raises(ValueError):
+        runner['run_pipeline'](['broken'])
@@ -0,0 +1,28 @@
+import pandas as pd
+
+from conftest import load_cells
+
+def cube_of(source, rows):
+    ns = load_cells('data-schema', 'progression-cube')
+    cube = ns['build_progression_cube']({source: rows})
+    return cube.groupby(['config', 'position'])['players'].sum().to_dict()
+
+def test_puzzle_player_counts_in_every_config_of_an_event():
+    start = pd.Timestamp('2025-10-01')
+    rows = pd.DataFrame({
+        'player_id': [1, 1, 2],
+        'puzzle_event_starts_at': [start] * 3,
+        'puzzle_config_display_name': ['a', 'b', 'a'],
+        'levels_completed': [5, 3, 2],
+    })
+    assert cube_of('puzzle', rows) == {('a', 5): 1, ('a', 2): 1, ('b', 3): 1}
+
+def test_mb_player_counts_once_per_event():
+    start = pd.Timestamp('2025-09-01')
+    rows = pd.DataFrame({
+        'player_id': [1, 1, 2],
+        'mb_event_start': [start] * 3,
+        'config_id': ['m1', 'm1', 'm1'],
+        'last_position': [4, 9, 2],
+    })
+    assert cube_of('mb', rows) == {('m1', 9): 1, ('m1', 2): 1}
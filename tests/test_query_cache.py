@@ -0,0 +1,95 @@
+import os
+import time
+from datetime import date
+
+import pytest
+
+from conftest import load_cells
+
+class StandInCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = None
+
+    def execute(self, sql):
+        self.conn.executed.append(sql)
+        self.description = [('n',), ('label',)]
+
+    def fetchall(self):
+        return [(len(self.conn.executed), 'x' * 1000)]
+
+    def close(self):
+        pass
+
+class StandInConnection:
+    """DB-API connection that records every executed statement."""
+    def __init__(self):
+        self.executed = []
+
+    def cursor(self):
+        return StandInCursor(self)
+
+@pytest.fixture
+def qc(tmp_path):
+    return load_cells('query-cache', params={'qc_cache_dir': str(tmp_path / 'qc'), 'qc_ttl_hours': 12, 'qc_max_gb': 20})
+
+def entry_path(qc, sql, window):
+    return os.path.join(qc['qc_cache_dir'], qc['qc_key'](sql, window) + '.parquet')
+
+def test_whitespace_and_case_differences_hit(qc):
+    conn, day = StandInConnection(), date(2025, 10, 1)
+    first = qc['cached_query'](conn, "select n, label\nfrom t where kind = 'A';", window=day)
+    again = qc['cached_query'](conn, "  SELECT n,   label FROM T\n  -- same query\n WHERE kind = 'A'", window=day)
+    assert len(conn.executed) == 1
+    assert again.equals(first)
+    # literals stay case-sensitive
+    qc['cached_query'](conn, "select n, label from t where kind = 'a'", window=day)
+    assert len(conn.executed) == 2
+
+def test_date_window_is_part_of_the_key(qc):
+    conn, sql = StandInConnection(), 'select n from t'
+    assert qc['qc_key'](sql, date(2025, 10, 1)) != qc['qc_key'](sql, date(2025, 10, 2))
+    qc['cached_query'](conn, sql, window=date(2025, 10, 1))
+    qc['cached_query'](conn, sql, window=date(2025, 10, 2))
+    qc['cached_query'](conn, sql, window=date(2025, 10, 1))
+    assert len(conn.executed) == 2
+
+def test_ttl_expires_an_entry(qc):
+    conn, sql, day = StandInConnection(), 'select n from t', date(2025, 10, 1)
+    qc['cached_query'](conn, sql, window=day)
+    path = entry_path(qc, sql, day)
+    old = time.time() - (qc['qc_ttl_hours'] * 3600 + 60)
+    os.utime(path, (old, old))
+    qc['cached_query'](conn, sql, window=day)
+    assert len(conn.executed) == 2
+    assert os.path.getmtime(path) > old
+
+def test_refresh_reruns_a_hit_and_replaces_the_entry(qc):
+    conn, sql, day = StandInConnection(), 'select n, label from t', date(2025, 10, 1)
+    first = qc['cached_query'](conn, sql, window=day)
+    assert qc['cached_query'](conn, sql, window=day).equals(first)
+    assert len(conn.executed) == 1
+    # as with query_cache_refresh = ['<dataset>'] in read-data-from-snowflake.py
+    fresh = qc['cached_query'](conn, sql, window=day, refresh=True, name='player_balance')
+    assert len(conn.executed) == 2
+    assert fresh['n'].tolist() == [2] and first['n'].tolist() == [1]
+    assert qc['cached_query'](conn, sql, window=day).equals(fresh)   # later hits serve the new result
+    assert len(conn.executed) == 2
+
+def test_evict_removes_least_recently_used_first(qc):
+    conn, day = StandInConnection(), date(2025, 10, 1)
+    queries = ['select 1 from t', 'select 2 from t', 'select 3 from t']
+    for sql in queries:
+        qc['cached_query'](conn, sql, window=day)
+    now = time.time()
+    paths = [entry_path(qc, sql, day) for sql in queries]
+    for age, path in zip([300, 200, 100], paths):   # query 1 used longest ago
+        os.utime(path, (now - age, os.path.getmtime(path)))
+    qc['cached_query'](conn, queries[0], window=day)   # a hit makes query 1 the most recent
+    assert len(conn.executed) == 3
+
+    sizes = [os.path.getsize(p) for p in paths]
+    qc['qc_evict'](max_gb=(sum(sizes) - 1) / 1024**3)
+    assert [os.path.exists(p) for p in paths] == [True, False, True]
+    qc['qc_evict'](max_gb=(sizes[0] + 1) / 1024**3)
+    assert [os.path.exists(p) for p in paths] == [True, False, False]